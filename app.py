@@ -1,18 +1,46 @@
 import os
+import csv
 import re
+import time
 import uuid
+import json
+import hashlib
+import itertools
+import numbers
+import multiprocessing
 import shutil
+import sqlite3
+import struct
 import tempfile
+import threading
+import click
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pydicom
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg') # Use Agg backend for non-interactive plotting
-import matplotlib.pyplot as plt
-from flask import Flask, render_template, request, redirect, url_for, session, send_file, flash
+from matplotlib.artist import setp
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, \
+    Response, stream_with_context, g, get_flashed_messages, make_response
 from werkzeug.utils import secure_filename
 from pydicom.tag import Tag 
 import datetime
-from io import BytesIO 
+from io import BytesIO, StringIO
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports are optional
+    pa = pq = None
 
 # ==============================================================================
 # ==== CONFIGURATION & APP INITIALIZATION ====
@@ -21,6 +49,7 @@ from io import BytesIO
 UPLOAD_FOLDER = 'uploads'
 STATIC_FOLDER = 'static'
 ALLOWED_EXTENSIONS = {'.dcm'}
+MODALITIES = ['CT', 'DX', 'MG']
 PER_PAGE = 20 
 
 # Target DAP unit and keys for DX modality
@@ -36,6 +65,25 @@ app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-please-change') 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 100000 * 1024 * 1024  
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+app.config['INGEST_JOB_THREADS'] = int(os.environ.get('INGEST_JOB_THREADS', 2))
+# What to do when an upload is already indexed (same SOPInstanceUID or file content): 'skip' or 'replace'.
+app.config['DUPLICATE_UPLOAD_POLICY'] = os.environ.get('DUPLICATE_UPLOAD_POLICY', 'skip')
+app.config['REPORT_DB_PATH'] = os.environ.get('REPORT_DB_PATH', os.path.join(UPLOAD_FOLDER, 'reports.sqlite3'))
+# Rendered comparison plots are cached in memory by each worker, capped by total size and count.
+app.config['PLOT_CACHE_MAX_BYTES'] = int(os.environ.get('PLOT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+app.config['PLOT_CACHE_MAX_ENTRIES'] = int(os.environ.get('PLOT_CACHE_MAX_ENTRIES', 256))
+# Worker processes rendering the charts of one page in parallel. Off by default (1 renders them in the request
+# thread): benchmarks/bench_plot_rendering.py showed no gain on small hosts, and the pool's first use starts a
+# forkserver.
+app.config['PLOT_WORKERS'] = int(os.environ.get('PLOT_WORKERS', 1))
+# How long browsers may reuse a /plot/<key> image; keys are content hashes, so a key's image never changes.
+app.config['PLOT_MAX_AGE'] = int(os.environ.get('PLOT_MAX_AGE', 24 * 3600))
+# Per-patient dose charts with more bars than this are charted as a histogram of their values (at most this many
+# bins); category charts (means per Study Description, a patient's studies) keep their this-many highest bars.
+app.config['CHART_MAX_BARS'] = int(os.environ.get('CHART_MAX_BARS', 60))
+# Draw comparison charts in the browser from the page's chart data; /plot/<key> PNGs are then only a fallback.
+app.config['CLIENT_SIDE_CHARTS'] = os.environ.get('CLIENT_SIDE_CHARTS', '1').lower() not in ('0', 'false', 'no')
 
 app.jinja_env.globals.update(zip=zip)
 
@@ -43,12 +91,16 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(STATIC_FOLDER, exist_ok=True)
 os.makedirs(os.path.join(STATIC_FOLDER, 'css'), exist_ok=True) 
 
-REPORT_INDEX = []
-
 @app.context_processor
 def inject_current_year():
     return {'current_year': datetime.datetime.now().year}
 
+@app.context_processor
+def inject_chart_settings():
+    # Client-drawn chart images only load their /plot/<key> PNG (from data-chart-src) if drawing fails.
+    client_side = app.config['CLIENT_SIDE_CHARTS']
+    return {'client_side_charts': client_side, 'chart_src_attr': 'data-chart-src' if client_side else 'src'}
+
 # ==============================================================================
 # ==== UTILITY FUNCTIONS ====
 # ==============================================================================
@@ -57,24 +109,17 @@ def allowed_file(filename):
     return '.' in filename and \
            os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS
 
-def clear_folder(folder_path, extensions_to_delete=None):
-    if not os.path.exists(folder_path):
-        print(f"Warning: Folder to clear does not exist: {folder_path}")
-        return
+def process_running(pid):
+    """Whether a process with this pid exists; assumed so where that can't be checked (non-POSIX)."""
+    if os.name != 'posix' or not pid:
+        return True
     try:
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            if extensions_to_delete is None or \
-               any(filename.lower().endswith(ext) for ext in extensions_to_delete):
-                try:
-                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path) 
-                except Exception as e:
-                    print(f"Failed to delete {file_path}. Reason: {e}")
-    except Exception as e:
-        print(f"Error listing directory {folder_path} for clearing: {e}")
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
 def format_date(dcm_date_str):
     if isinstance(dcm_date_str, str) and len(dcm_date_str) == 8 and dcm_date_str.isdigit():
@@ -113,10 +158,782 @@ def get_clean_value(dataset, tag_or_keyword, default='N/A'):
         print(f"Error getting value for tag/keyword '{tag_or_keyword}': {type(e).__name__} - {e}")
         return default
 
+# ==============================================================================
+# ==== REPORT STORE ====
+# ==============================================================================
+
+REPORT_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    modality TEXT NOT NULL,
+    patient_id TEXT,
+    study_description TEXT,
+    study_date TEXT,
+    sop_instance_uid TEXT,
+    content_hash TEXT,
+    dose REAL,
+    study_date_int INTEGER,
+    body_part TEXT,
+    view_position TEXT,
+    filename TEXT,
+    series_description TEXT,
+    organ_exposed TEXT,
+    study_date_display TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reports_modality ON reports (modality, seq);
+CREATE INDEX IF NOT EXISTS idx_reports_modality_patient ON reports (modality, patient_id, seq);
+CREATE INDEX IF NOT EXISTS idx_reports_study_description ON reports (modality, study_description);
+CREATE INDEX IF NOT EXISTS idx_reports_study_date ON reports (modality, study_date);
+CREATE INDEX IF NOT EXISTS idx_reports_sop_instance_uid ON reports (sop_instance_uid);
+CREATE INDEX IF NOT EXISTS idx_reports_content_hash ON reports (content_hash);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS report_changes (
+    modality TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    seq INTEGER,
+    added INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_report_changes ON report_changes (modality, version);
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id TEXT PRIMARY KEY,
+    modality TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    errors TEXT NOT NULL DEFAULT '[]',
+    created_at TEXT NOT NULL,
+    worker_pid INTEGER,
+    save_names TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS plot_specs (
+    key TEXT PRIMARY KEY,
+    spec TEXT NOT NULL
+);
+"""
+
+# Typed columns parsed from a record once, when it is stored (see report_typed_fields).
+REPORT_TYPED_COLUMNS = ('dose', 'study_date_int', 'body_part', 'view_position', 'filename', 'series_description',
+                        'organ_exposed', 'study_date_display')
+# Columns the report list can be sorted on. Each gets a (modality, column, seq) index so a sorted page is an
+# index range scan; text columns sort case-insensitively.
+REPORT_SORT_COLUMNS = {
+    'seq': '', 'dose': '', 'study_date_int': '',
+    'filename': 'COLLATE NOCASE', 'patient_id': 'COLLATE NOCASE', 'study_description': 'COLLATE NOCASE',
+    'series_description': 'COLLATE NOCASE', 'body_part': 'COLLATE NOCASE', 'view_position': 'COLLATE NOCASE',
+    'organ_exposed': 'COLLATE NOCASE',
+}
+REPORT_SORT_INDEXES = ''.join(
+    f'CREATE INDEX IF NOT EXISTS idx_reports_sort_{column} ON reports (modality, {column} {collation}, seq);\n'
+    for column, collation in REPORT_SORT_COLUMNS.items() if column != 'seq'
+)
+
+# Fields the report list search box matches (as substrings), as SQL expressions over a `reports` row
+# ({row} is the row prefix). The report_search FTS5 table indexes their trigrams, kept in sync by triggers.
+REPORT_SEARCH_FIELDS = {
+    'filename': '{row}filename',
+    'patient_id': '{row}patient_id',
+    'study_date': '{row}study_date_display',
+    'raw_study_date': '{row}study_date',
+    'study_description': '{row}study_description',
+    'body_part': '{row}body_part',
+    'view_position': '{row}view_position',
+    'organ_exposed': '{row}organ_exposed',
+}
+REPORT_SEARCH_SCHEMA = (
+    f"CREATE VIRTUAL TABLE report_search USING fts5({', '.join(REPORT_SEARCH_FIELDS)}, tokenize='trigram')",
+    f"INSERT INTO report_search (rowid, {', '.join(REPORT_SEARCH_FIELDS)}) "
+    f"SELECT seq, {', '.join(e.format(row='') for e in REPORT_SEARCH_FIELDS.values())} FROM reports",
+    f"CREATE TRIGGER IF NOT EXISTS reports_search_insert AFTER INSERT ON reports BEGIN "
+    f"INSERT INTO report_search (rowid, {', '.join(REPORT_SEARCH_FIELDS)}) "
+    f"VALUES (new.seq, {', '.join(e.format(row='new.') for e in REPORT_SEARCH_FIELDS.values())}); END",
+    "CREATE TRIGGER IF NOT EXISTS reports_search_delete AFTER DELETE ON reports BEGIN "
+    "DELETE FROM report_search WHERE rowid = old.seq; END",
+)
+# A trigram phrase match is a case-insensitive substring match, so terms of this length or more are
+# answered by the index alone. Shorter terms, and non-ASCII ones (where FTS5 case folding may differ
+# from str.lower), are matched by scanning the columns.
+REPORT_SEARCH_MIN_TERM = 3
+
+# Column layout of ReportStore.frame(): typed columns plus the display strings the comparison tables show.
+REPORT_FRAME_QUERY = """
+SELECT id, seq, patient_id, study_date AS raw_study_date, study_date_int, study_description, body_part,
+       view_position, dose, filename, study_date_display AS study_date, series_description, organ_exposed
+FROM reports WHERE modality = ?
+"""
+REPORT_FRAME_CATEGORIES = ('study_description', 'series_description', 'body_part', 'view_position', 'organ_exposed')
+
+def parse_dose_value(value):
+    """Dose as float, or None for missing/'N/A (...)'/'Invalid ...' placeholders."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number
+
+def parse_study_date(raw_study_date):
+    raw = str(raw_study_date or '').strip()
+    return int(raw) if len(raw) == 8 and raw.isdigit() else None
+
+def report_typed_fields(report):
+    """Values of a report record for REPORT_TYPED_COLUMNS, in order."""
+    dose_key = {'CT': 'total_dlp', 'DX': TARGET_DAP_STORAGE_KEY_DX, 'MG': TARGET_ORGAN_DOSE_STORAGE_KEY_MG}.get(report['modality'])
+    return (parse_dose_value(report.get(dose_key)) if dose_key else None,
+            parse_study_date(report.get('Raw Study Date')),
+            report.get('body_part'), report.get('view_position'), report.get('filename'),
+            report.get('series_description'), report.get('organ_exposed'), report.get('Study Date'))
+
+# Running per-Study-Description totals behind the CT mean DLP / mean CTDIvol pages. Updated by
+# ReportStore.add/delete in the same transaction as the report itself.
+CT_AGGREGATES_SCHEMA = """
+CREATE TABLE ct_study_aggregates (
+    study_description TEXT PRIMARY KEY,
+    report_count INTEGER NOT NULL,
+    dlp_count INTEGER NOT NULL,
+    dlp_sum REAL NOT NULL,
+    dlp_sumsq REAL NOT NULL,
+    dlp_min REAL,
+    dlp_max REAL,
+    event_count INTEGER NOT NULL,
+    ctdivol_sum REAL NOT NULL,
+    ctdivol_sumsq REAL NOT NULL,
+    ctdivol_min REAL,
+    ctdivol_max REAL
+);
+"""
+# Recomputes aggregate rows from the stored report records (JSON1); used to backfill older
+# databases and to restore min/max after the current extreme of a group is deleted.
+CT_AGGREGATES_REBUILD = """
+INSERT INTO ct_study_aggregates
+SELECT r.study_description, COUNT(*), COUNT(r.dlp), TOTAL(r.dlp), TOTAL(r.dlp * r.dlp), MIN(r.dlp), MAX(r.dlp),
+       CAST(TOTAL(e.n) AS INTEGER), TOTAL(e.s), TOTAL(e.ss), MIN(e.mn), MAX(e.mx)
+FROM (SELECT id, study_description, json_extract(data, '$.total_dlp') AS dlp FROM reports
+      WHERE modality = 'CT' AND study_description != 'N/A' {where}) AS r
+LEFT JOIN (SELECT reports.id AS id, COUNT(j.value) AS n, TOTAL(j.value) AS s, TOTAL(j.value * j.value) AS ss,
+                  MIN(j.value) AS mn, MAX(j.value) AS mx
+           FROM reports, json_each(reports.data, '$.ctdivol_values') AS j
+           WHERE reports.modality = 'CT' {where_events} GROUP BY reports.id) AS e ON e.id = r.id
+GROUP BY r.study_description
+"""
+
+class ReportStore:
+    """Report index persisted in SQLite and shared by all threads and worker processes."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._sorted_views = OrderedDict()
+        self._distinct_values = {}
+        self._sorted_views_lock = threading.Lock()
+        self._search_index = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.create_function('py_lower', 1, lambda value: value.lower() if isinstance(value, str) else value,
+                                 deterministic=True)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(REPORT_STORE_SCHEMA + REPORT_SORT_INDEXES)
+            self._migrate(conn)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self, conn=None):
+        """A write transaction holding the database write lock from its start (waits up to the connect timeout)."""
+        conn = conn or self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+
+    def _migrate(self, conn):
+        # Workers starting together may all get here; each step re-checks under the write lock so only one applies it.
+        self._migrate_search_index(conn)
+        has_aggregates = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ct_study_aggregates'"
+        ).fetchone()
+        if not has_aggregates:
+            with self._write(conn):
+                if not conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ct_study_aggregates'"
+                ).fetchone():
+                    conn.execute(CT_AGGREGATES_SCHEMA)
+                    self._rebuild_ct_aggregates(conn)
+
+    def _migrate_search_index(self, conn):
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'report_search'").fetchone():
+            self._search_index = True
+            return
+        try:
+            with self._write(conn):
+                if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'report_search'").fetchone():
+                    for statement in REPORT_SEARCH_SCHEMA:
+                        conn.execute(statement)
+            self._search_index = True
+        except sqlite3.OperationalError as e:
+            print(f"Report search index unavailable (SQLite without FTS5 trigram?), searching by scan: {e}")
+            self._search_index = False
+
+    def _rebuild_ct_aggregates(self, conn, study_description=None):
+        if study_description is None:
+            conn.execute('DELETE FROM ct_study_aggregates')
+            conn.execute(CT_AGGREGATES_REBUILD.format(where='', where_events=''))
+        else:
+            conn.execute('DELETE FROM ct_study_aggregates WHERE study_description = ?', (study_description,))
+            conn.execute(CT_AGGREGATES_REBUILD.format(where='AND study_description = ?',
+                                                      where_events='AND reports.study_description = ?'),
+                         (study_description, study_description))
+
+    def _add_to_ct_aggregates(self, conn, report):
+        study_description = report.get('study_description', '').strip()
+        if report['modality'] != 'CT' or study_description == 'N/A':
+            return
+        dlp = report.get('total_dlp')
+        ctdivols = report.get('ctdivol_values') or []
+        conn.execute(
+            'INSERT INTO ct_study_aggregates VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (study_description) DO UPDATE SET '
+            'report_count = report_count + 1, dlp_count = dlp_count + excluded.dlp_count, '
+            'dlp_sum = dlp_sum + excluded.dlp_sum, dlp_sumsq = dlp_sumsq + excluded.dlp_sumsq, '
+            'dlp_min = MIN(COALESCE(dlp_min, excluded.dlp_min), COALESCE(excluded.dlp_min, dlp_min)), '
+            'dlp_max = MAX(COALESCE(dlp_max, excluded.dlp_max), COALESCE(excluded.dlp_max, dlp_max)), '
+            'event_count = event_count + excluded.event_count, ctdivol_sum = ctdivol_sum + excluded.ctdivol_sum, '
+            'ctdivol_sumsq = ctdivol_sumsq + excluded.ctdivol_sumsq, '
+            'ctdivol_min = MIN(COALESCE(ctdivol_min, excluded.ctdivol_min), COALESCE(excluded.ctdivol_min, ctdivol_min)), '
+            'ctdivol_max = MAX(COALESCE(ctdivol_max, excluded.ctdivol_max), COALESCE(excluded.ctdivol_max, ctdivol_max))',
+            (study_description, 0 if dlp is None else 1, dlp or 0.0, (dlp or 0.0) ** 2, dlp, dlp,
+             len(ctdivols), sum(ctdivols), sum(v * v for v in ctdivols),
+             min(ctdivols) if ctdivols else None, max(ctdivols) if ctdivols else None)
+        )
+
+    def _remove_from_ct_aggregates(self, conn, report):
+        study_description = report.get('study_description', '').strip()
+        if report['modality'] != 'CT' or study_description == 'N/A':
+            return
+        row = conn.execute('SELECT * FROM ct_study_aggregates WHERE study_description = ?',
+                           (study_description,)).fetchone()
+        if row is None:
+            return
+        dlp = report.get('total_dlp')
+        ctdivols = report.get('ctdivol_values') or []
+        if row['report_count'] <= 1:
+            conn.execute('DELETE FROM ct_study_aggregates WHERE study_description = ?', (study_description,))
+        elif (dlp is not None and dlp in (row['dlp_min'], row['dlp_max'])) or \
+             (ctdivols and (min(ctdivols) == row['ctdivol_min'] or max(ctdivols) == row['ctdivol_max'])):
+            # The report held one of the group's extremes; min/max can't be decremented, so recount the group.
+            self._rebuild_ct_aggregates(conn, study_description)
+        else:
+            conn.execute(
+                'UPDATE ct_study_aggregates SET report_count = report_count - 1, dlp_count = dlp_count - ?, '
+                'dlp_sum = dlp_sum - ?, dlp_sumsq = dlp_sumsq - ?, event_count = event_count - ?, '
+                'ctdivol_sum = ctdivol_sum - ?, ctdivol_sumsq = ctdivol_sumsq - ? WHERE study_description = ?',
+                (0 if dlp is None else 1, dlp or 0.0, (dlp or 0.0) ** 2, len(ctdivols), sum(ctdivols),
+                 sum(v * v for v in ctdivols), study_description)
+            )
+
+    def add(self, report, replace_duplicates=False, skip_duplicates=False):
+        """Inserts a report; returns the duplicates it replaced, or None when skip_duplicates skipped it."""
+        replaced, removed_seqs = [], {}
+        with self._write() as conn:
+            if replace_duplicates or skip_duplicates:
+                duplicates = self._duplicate_rows(conn, report.get('content_hash'), report.get('sop_instance_uid'))
+                if duplicates and not replace_duplicates:
+                    return None
+                for row in duplicates:
+                    conn.execute('DELETE FROM reports WHERE id = ?', (row['id'],))
+                    replaced.append(json.loads(row['data']))
+                    removed_seqs.setdefault(row['modality'], []).append(row['seq'])
+                    self._remove_from_ct_aggregates(conn, replaced[-1])
+            cursor = conn.execute(
+                'INSERT INTO reports (id, modality, patient_id, study_description, study_date, '
+                f'sop_instance_uid, content_hash, {", ".join(REPORT_TYPED_COLUMNS)}, data) '
+                f'VALUES ({", ".join("?" * (len(REPORT_TYPED_COLUMNS) + 8))})',
+                (report['id'], report['modality'], report.get('Patient ID', '').strip(),
+                 report.get('study_description', '').strip(), report.get('Raw Study Date', ''),
+                 report.get('sop_instance_uid'), report.get('content_hash'))
+                + report_typed_fields(report) + (json.dumps(report),)
+            )
+            self._add_to_ct_aggregates(conn, report)
+            for modality, seqs in removed_seqs.items():
+                if modality != report['modality']:
+                    self._log_changes(conn, modality, removed=seqs)
+            self._log_changes(conn, report['modality'], added=[cursor.lastrowid],
+                              removed=removed_seqs.get(report['modality'], ()))
+            self._bump_version(conn)
+        return replaced
+
+    def _duplicate_rows(self, conn, content_hash, sop_instance_uid):
+        return conn.execute(
+            'SELECT seq, id, modality, data FROM reports WHERE content_hash = ? '
+            'UNION SELECT seq, id, modality, data FROM reports WHERE sop_instance_uid = ?',
+            (content_hash, sop_instance_uid)
+        ).fetchall()
+
+    def find_duplicate(self, content_hash, sop_instance_uid):
+        """An indexed report with the same content hash or SOPInstanceUID, or None."""
+        rows = self._duplicate_rows(self._connection(), content_hash, sop_instance_uid)
+        return json.loads(rows[0]['data']) if rows else None
+
+    def get(self, report_id):
+        row = self._connection().execute('SELECT data FROM reports WHERE id = ?', (report_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def delete(self, report_id):
+        """Removes a report and returns its record, or None if the id is unknown."""
+        with self._write() as conn:
+            row = conn.execute('SELECT seq, modality, data FROM reports WHERE id = ?', (report_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('DELETE FROM reports WHERE id = ?', (report_id,))
+            report = json.loads(row['data'])
+            self._remove_from_ct_aggregates(conn, report)
+            self._log_changes(conn, row['modality'], removed=[row['seq']])
+            self._bump_version(conn)
+        return report
+
+    def known_fingerprints(self, content_hashes, sop_instance_uids):
+        """Returns the subsets of the given content hashes and SOPInstanceUIDs that are already indexed."""
+        conn = self._connection()
+        found = {}
+        for column, values in (('content_hash', content_hashes), ('sop_instance_uid', sop_instance_uids)):
+            values = [v for v in set(values) if v]
+            found[column] = set()
+            for start in range(0, len(values), 500):
+                chunk = values[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT {column} FROM reports WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                found[column].update(row[0] for row in rows)
+        return found['content_hash'], found['sop_instance_uid']
+
+    def clear(self, modality=None):
+        """Removes every report (or those of one modality) and returns the removed reports' save names."""
+        with self._write() as conn:
+            where, params = ('', ()) if modality is None else (' WHERE modality = ?', (modality,))
+            rows = conn.execute(f"SELECT modality, json_extract(data, '$.save_name') FROM reports{where}",
+                                params).fetchall()
+            conn.execute(f'DELETE FROM reports{where}', params)
+            if modality in (None, 'CT'):
+                conn.execute('DELETE FROM ct_study_aggregates')
+            for cleared_modality in {row[0] for row in rows}:
+                self._log_changes(conn, cleared_modality, cleared=True)
+            self._bump_version(conn)
+        return [row[1] for row in rows]
+
+    def _bump_version(self, conn):
+        conn.execute("INSERT INTO store_meta VALUES ('version', 1) "
+                     "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+    def version(self):
+        """Counter bumped by every change to the stored reports, from any thread or process."""
+        row = self._connection().execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()
+        return row['value'] if row else 0
+
+    def _modality_version(self, conn, modality):
+        row = conn.execute('SELECT value FROM store_meta WHERE key = ?', (f'version:{modality}',)).fetchone()
+        return row['value'] if row else 0
+
+    def _log_changes(self, conn, modality, added=(), removed=(), cleared=False):
+        """Bumps a modality's version and logs the seqs it added and removed, so cached views can catch up."""
+        conn.execute('INSERT INTO store_meta VALUES (?, 1) ON CONFLICT (key) DO UPDATE SET value = value + 1',
+                     (f'version:{modality}',))
+        version = self._modality_version(conn, modality)
+        if cleared:
+            changes = [(modality, version, None, 0)]
+        else:
+            changes = [(modality, version, seq, 0) for seq in removed] + [(modality, version, seq, 1) for seq in added]
+        conn.executemany('INSERT INTO report_changes (modality, version, seq, added) VALUES (?, ?, ?, ?)', changes)
+        conn.execute('DELETE FROM report_changes WHERE modality = ? AND version <= ?',
+                     (modality, version - REPORT_CHANGE_LOG_VERSIONS))
+
+    def _changes_since(self, conn, modality, version):
+        """(added seqs, removed seqs) of a modality after `version`, or None if a clear or the log's pruning
+        means the caller must start over."""
+        added, removed, expected = {}, set(), version + 1
+        for row in conn.execute('SELECT version, seq, added FROM report_changes WHERE modality = ? AND version > ? '
+                                'ORDER BY version, rowid', (modality, version)):
+            if row['version'] > expected or row['seq'] is None:
+                return None
+            expected = row['version'] + 1
+            if row['added']:
+                added[row['seq']] = None
+            elif row['seq'] in added:
+                del added[row['seq']]
+            else:
+                removed.add(row['seq'])
+        if expected != self._modality_version(conn, modality) + 1:
+            return None
+        return list(added), removed
+
+    def sorted_view(self, modality, sort_column, search_term=None, search_fields=()):
+        """A modality's report seqs in sort_column order, optionally narrowed by a search. Cached, and brought up to
+        date from the change log when the modality's reports change."""
+        key = (modality, sort_column, search_term or None, tuple(search_fields) if search_term else ())
+        conn = self._connection()
+        with self._sorted_views_lock:
+            view = self._sorted_views.get(key)
+        where, params = self._list_filter(modality, search_term, search_fields)
+        with conn:
+            conn.execute('BEGIN')
+            version = self._modality_version(conn, modality)
+            if view is not None and view.version == version:
+                changes = None
+            else:
+                changes = self._changes_since(conn, modality, view.version) if view is not None else None
+                if changes is None:
+                    cursor = conn.cursor()
+                    cursor.row_factory = None  # plain tuples: a Row per report would double the rebuild time
+                    view = SortedReportView.build(version, sort_column, cursor.execute(
+                        f'SELECT seq, {sort_column} FROM reports WHERE {where} '
+                        f'ORDER BY {sort_column} {REPORT_SORT_COLUMNS[sort_column]}, seq', params))
+                else:
+                    added, removed = changes
+                    view = view.updated(version, removed, self._rows_by_seq(
+                        conn, f'seq, {sort_column}', where, params, added))
+        with self._sorted_views_lock:
+            cached = self._sorted_views.get(key)
+            if cached is None or cached.version <= view.version:
+                self._sorted_views[key] = view
+            self._sorted_views.move_to_end(key)
+            while len(self._sorted_views) > SORTED_VIEW_CACHE_SIZE:
+                self._sorted_views.popitem(last=False)
+        return view
+
+    def _rows_by_seq(self, conn, columns, where, params, seqs):
+        rows = []
+        for start in range(0, len(seqs), 500):
+            chunk = seqs[start:start + 500]
+            rows += conn.execute(f"SELECT {columns} FROM reports WHERE {where} AND seq IN ({', '.join('?' * len(chunk))})",
+                                 list(params) + chunk).fetchall()
+        return rows
+
+    def by_seq(self, seqs):
+        """Records for the given seqs, in the order given; seqs deleted in the meantime are skipped."""
+        seqs = list(seqs)
+        if not seqs:
+            return []
+        rows = self._connection().execute(
+            f"SELECT seq, data FROM reports WHERE seq IN ({', '.join('?' * len(seqs))})", seqs)
+        by_seq = {row['seq']: json.loads(row['data']) for row in rows}
+        return [by_seq[seq] for seq in seqs if seq in by_seq]
+
+    def count(self, modality):
+        return len(self.sorted_view(modality, 'seq'))
+
+    def _list_filter(self, modality, search_term, search_fields):
+        """WHERE clause for a modality's reports whose `search_fields` (REPORT_SEARCH_FIELDS keys) contain the term."""
+        where, params = 'modality = ?', [modality]
+        if not search_term:
+            return where, params
+        term = search_term.lower()
+        # SQLite's lower() only folds ASCII; that is enough for an ASCII term.
+        lower = 'lower' if term.isascii() else 'py_lower'
+        if self._search_index and len(term) >= REPORT_SEARCH_MIN_TERM and term.isascii():
+            where += ' AND seq IN (SELECT rowid FROM report_search WHERE report_search MATCH ?)'
+            return where, params + ['{%s} : "%s"' % (' '.join(search_fields), term.replace('"', '""'))]
+        expressions = [REPORT_SEARCH_FIELDS[field].format(row='') for field in search_fields]
+        where += ' AND (' + ' OR '.join(f"instr({lower}(COALESCE({e}, '')), ?) > 0" for e in expressions) + ')'
+        return where, params + [term] * len(expressions)
+
+    def distinct_values(self, modality, column):
+        """Sorted distinct non-empty values of a text column for one modality, excluding 'N/A'.
+        Cached; values of reports added since are merged in, and after removals each cached value is looked up
+        again (through the column's sort index) rather than scanning the modality's reports."""
+        key = (modality, column)
+        where = f"modality = ? AND {column} IS NOT NULL AND {column} NOT IN ('', 'N/A')"
+        conn = self._connection()
+        with self._sorted_views_lock:
+            cached = self._distinct_values.get(key)
+        with conn:
+            conn.execute('BEGIN')
+            version = self._modality_version(conn, modality)
+            if cached is not None and cached[0] == version:
+                return list(cached[1])
+            changes = self._changes_since(conn, modality, cached[0]) if cached is not None else None
+            if changes is None:
+                values = {row[0] for row in conn.execute(f'SELECT DISTINCT {column} FROM reports WHERE {where}',
+                                                         (modality,))}
+            else:
+                added, removed = changes
+                values = set(cached[1])
+                if removed:
+                    values = {value for value in values if conn.execute(
+                        f'SELECT 1 FROM reports WHERE modality = ? AND {column} = ? COLLATE NOCASE AND {column} = ? '
+                        'LIMIT 1', (modality, value, value)).fetchone()}
+                values.update(row[0] for row in self._rows_by_seq(conn, column, where, (modality,), added))
+        values = tuple(sorted(values))
+        with self._sorted_views_lock:
+            if key not in self._distinct_values or self._distinct_values[key][0] <= version:
+                self._distinct_values[key] = (version, values)
+        return list(values)
+
+    def ct_study_aggregates(self):
+        """Per-Study-Description CT totals (counts, sums, sums of squares, min/max of DLP and CTDIvol)."""
+        rows = self._connection().execute('SELECT * FROM ct_study_aggregates ORDER BY study_description')
+        return [dict(row) for row in rows]
+
+    def reports(self, modality, patient_id=None, study_description=None):
+        """Reports of one modality in upload order, optionally narrowed by Patient ID / Study Description."""
+        query, params = 'SELECT data FROM reports WHERE modality = ?', [modality]
+        if patient_id is not None:
+            query += ' AND patient_id = ?'
+            params.append(patient_id.strip())
+        if study_description is not None:
+            query += ' AND study_description = ?'
+            params.append(study_description.strip())
+        query += ' ORDER BY seq'
+        return [json.loads(row['data']) for row in self._connection().execute(query, params)]
+
+    def iter_columns(self, modality, columns, study_description=None, body_part=None, order_by=None, batch_size=1000):
+        """Yields tuples of one modality's report columns in upload order (or order_by), fetched in batches."""
+        query, params = f"SELECT {', '.join(columns)} FROM reports WHERE modality = ?", [modality]
+        if study_description is not None:
+            query += ' AND study_description = ?'
+            params.append(study_description.strip())
+        if body_part is not None:
+            query += ' AND upper(trim(body_part)) = ?'
+            params.append(body_part.strip().upper())
+        order = f'{order_by}, seq' if order_by else 'seq'
+        cursor = self._connection().execute(f'{query} ORDER BY {order}', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield tuple(row)
+
+    def frame(self, modality, patient_id=None):
+        """Reports of one modality as a typed DataFrame, in upload order."""
+        query, params = REPORT_FRAME_QUERY, [modality]
+        if patient_id is not None:
+            query += ' AND patient_id = ?'
+            params.append(patient_id.strip())
+        df = pd.read_sql_query(query + ' ORDER BY seq', self._connection(), params=params)
+        df['dose'] = df['dose'].astype('float64')
+        df['study_date_int'] = df['study_date_int'].astype('Int64')
+        for column in REPORT_FRAME_CATEGORIES:
+            df[column] = df[column].astype('category')
+        return df
+
+    # --- Upload ingestion jobs (kept here so any worker can answer status polls) ---
+
+    def create_job(self, job_id, modality, total, errors, save_names=()):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT INTO ingest_jobs (id, modality, status, total, failed, errors, created_at, worker_pid, save_names) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, modality, 'queued', total, len(errors), json.dumps(errors),
+                 datetime.datetime.now().isoformat(timespec='seconds'), os.getpid(), json.dumps(list(save_names)))
+            )
+
+    def update_job(self, job_id, status=None, processed=None, errors=None):
+        assignments, params = [], []
+        if status is not None:
+            assignments.append('status = ?'); params.append(status)
+        if processed is not None:
+            assignments.append('processed = ?'); params.append(processed)
+        if errors is not None:
+            assignments.append('failed = ?'); params.append(len(errors))
+            assignments.append('errors = ?'); params.append(json.dumps(errors))
+        conn = self._connection()
+        with conn:
+            conn.execute(f"UPDATE ingest_jobs SET {', '.join(assignments)} WHERE id = ?", params + [job_id])
+
+    def fail_orphaned_jobs(self):
+        """Fails unfinished jobs of exited workers (or of this one) and returns their never-indexed upload save names."""
+        with self._write() as conn:
+            orphaned = [row for row in conn.execute("SELECT * FROM ingest_jobs WHERE status IN ('queued', 'running')")
+                        if row['worker_pid'] == os.getpid() or not process_running(row['worker_pid'])]
+            if not orphaned:
+                return []
+            for row in orphaned:
+                errors = json.loads(row['errors']) + [ORPHANED_JOB_ERROR]
+                conn.execute("UPDATE ingest_jobs SET status = 'failed', failed = ?, errors = ? WHERE id = ?",
+                             (row['total'] - row['processed'], json.dumps(errors), row['id']))
+            return self.unindexed_save_names((name for row in orphaned for name in json.loads(row['save_names'])), conn)
+
+    def unindexed_save_names(self, save_names, conn=None):
+        """The given upload save names that no stored report refers to, sorted."""
+        conn = conn or self._connection()
+        indexed = {row[0] for row in conn.execute("SELECT json_extract(data, '$.save_name') FROM reports")}
+        return sorted(set(save_names) - indexed)
+
+    def get_job(self, job_id):
+        """A job's public status: id, modality, status, created_at, the file counts and the error messages."""
+        row = self._connection().execute(
+            'SELECT id, modality, status, created_at, total, processed, failed, errors FROM ingest_jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['errors'] = json.loads(job['errors'])
+        job['remaining'] = max(0, job['total'] - job['processed'] - job['failed'])
+        return job
+
+    # --- Comparison chart specs (so any worker can render a /plot/<key> image on demand) ---
+
+    def save_plot_specs(self, specs):
+        """Records the {key: spec} charts, keeping the PLOT_SPEC_MAX_ENTRIES most recently saved."""
+        if not specs:
+            return
+        with self._write() as conn:
+            # REPLACE gives a re-saved key a new, highest rowid, so rowids order the specs by recency.
+            conn.executemany('INSERT OR REPLACE INTO plot_specs (key, spec) VALUES (?, ?)',
+                             [(key, json.dumps(spec, default=str)) for key, spec in specs.items()])
+            conn.execute('DELETE FROM plot_specs WHERE rowid <= (SELECT MAX(rowid) FROM plot_specs) - ?',
+                         (PLOT_SPEC_MAX_ENTRIES,))
+
+    def plot_spec(self, key):
+        row = self._connection().execute('SELECT spec FROM plot_specs WHERE key = ?', (key,)).fetchone()
+        return json.loads(row['spec']) if row else None
+
+SORTED_VIEW_CACHE_SIZE = 64
+# Versions of a modality's change log kept for cached sorted views to catch up on; views older than that rebuild.
+REPORT_CHANGE_LOG_VERSIONS = 10000
+ORPHANED_JOB_ERROR = "Ingestion job interrupted: its server worker stopped before all files were indexed."
+PLOT_SPEC_MAX_ENTRIES = 10000
+
+# SQLite's NOCASE collation folds ASCII letters only.
+_NOCASE_FOLD = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+class SortedReportView:
+    """Report seqs of one modality in sort order: those missing the sort value (by seq), then the rest.
+    `keys` holds the sort key of each `present` seq, so added reports can be placed without re-sorting."""
+
+    def __init__(self, version, sort_column, missing, present, keys):
+        self.version = version
+        self.sort_column = sort_column
+        self.missing = missing
+        self.present = present
+        self.keys = keys
+
+    @classmethod
+    def build(cls, version, sort_column, rows):
+        """A view from (seq, sort value) rows in SQL sort order (NULLs first, then by value and seq)."""
+        missing, present, values = [], [], []
+        for seq, value in rows:
+            if value is None:
+                missing.append(seq)
+            else:
+                present.append(seq)
+                values.append(value)
+        return cls(version, sort_column, np.array(missing, dtype=np.int64), np.array(present, dtype=np.int64),
+                   cls._sort_keys(sort_column, values))
+
+    @staticmethod
+    def _sort_keys(sort_column, values):
+        if not REPORT_SORT_COLUMNS[sort_column]:
+            return np.array(values, dtype=np.float64)
+        folded = {}
+        keys = np.empty(len(values), dtype=object)
+        for index, value in enumerate(values):
+            key = folded.get(value)
+            if key is None:
+                key = folded[value] = value.translate(_NOCASE_FOLD)
+            keys[index] = key
+        return keys
+
+    def updated(self, version, removed, added_rows):
+        """A copy at `version` without the removed seqs and with the added (seq, sort value) rows in place."""
+        missing, present, keys = self.missing, self.present, self.keys
+        if removed:
+            removed = np.fromiter(removed, dtype=np.int64, count=len(removed))
+            missing = missing[~np.isin(missing, removed)]
+            kept = ~np.isin(present, removed)
+            present, keys = present[kept], keys[kept]
+        added_missing = sorted(seq for seq, value in added_rows if value is None)
+        if added_missing:
+            missing = np.concatenate([missing, np.array(added_missing, dtype=np.int64)])
+        added_present = [(seq, value) for seq, value in added_rows if value is not None]
+        if added_present:
+            added_keys = self._sort_keys(self.sort_column, [value for _, value in added_present])
+            order = sorted(range(len(added_present)), key=lambda i: (added_keys[i], added_present[i][0]))
+            added_seqs = np.array([added_present[i][0] for i in order], dtype=np.int64)
+            added_keys = added_keys[order]
+            # Added seqs are newer (higher) than any present one, so they go after equal keys.
+            at = np.searchsorted(keys, added_keys, side='right')
+            present, keys = np.insert(present, at, added_seqs), np.insert(keys, at, added_keys)
+        return SortedReportView(version, self.sort_column, missing, present, keys)
+
+    def __len__(self):
+        return len(self.missing) + len(self.present)
+
+    def page(self, offset, limit, descending=False):
+        """Seqs at positions [offset, offset + limit); descending reverses each part but keeps missing first."""
+        seqs = []
+        for position in range(max(offset, 0), min(offset + limit, len(self))):
+            if position < len(self.missing):
+                part, index = self.missing, position
+            else:
+                part, index = self.present, position - len(self.missing)
+            seqs.append(int(part[len(part) - 1 - index] if descending else part[index]))
+        return seqs
+
+REPORT_STORE = ReportStore(app.config['REPORT_DB_PATH'])
+
 # ==============================================================================
 # ==== DICOM DOSE REPORT EXTRACTION FUNCTIONS ====
 # ==============================================================================
 
+# Header tags each extractor consumes. read_dose_dataset loads only these and stops after the last
+# one, which skips the large private groups and the SR ContentSequence (0040,A730) that a full
+# stop_before_pixels read still decodes.
+_COMMON_DOSE_TAGS = [
+    (0x0008, 0x0018),  # SOP Instance UID
+    (0x0008, 0x0060),  # Modality
+    (0x0010, 0x0020),  # Patient ID
+    (0x0008, 0x0020),  # Study Date
+]
+DOSE_TAGS_BY_MODALITY = {
+    'DX': _COMMON_DOSE_TAGS + [
+        (0x0018, 0x0015), (0x0018, 0x5101), (0x0018, 0x1152), (0x0018, 0x0060), (0x0018, 0x1110),
+        (0x0018, 0x1160), (0x0018, 0x1166), (0x0018, 0x1190), (0x0018, 0x115E), (0x0040, 0x8302),
+    ],
+    'MG': _COMMON_DOSE_TAGS + [
+        (0x0010, 0x1010), (0x0008, 0x1030), (0x0008, 0x103E), (0x0018, 0x0015), (0x0018, 0x5101),
+        (0x0018, 0x0060), (0x0018, 0x1152), (0x0018, 0x1150), (0x0018, 0x1151), (0x0040, 0x8302),
+        (0x0040, 0x0316), (0x0040, 0x0318), (0x0018, 0x11A0), (0x0018, 0x11A2), (0x0018, 0x1160),
+        (0x0018, 0x1191),
+    ],
+    'CT': _COMMON_DOSE_TAGS + [
+        (0x0010, 0x1010),  # Patient Age
+        (0x0008, 0x0070),  # Manufacturer
+        (0x0008, 0x1030),  # Study Description
+        (0x0008, 0x103E),  # Series Description
+        (0x0040, 0x0310),  # Comments on Radiation Dose
+        (0x0040, 0x030E),  # Exposure Dose Sequence
+    ],
+}
+
+def read_header_tags(path_or_file, tags):
+    """Reads only `tags` from a DICOM header and stops as soon as the last of them has been passed."""
+    specific_tags = [Tag(tag) for tag in tags]
+    last_tag = max(specific_tags)
+    def past_last_tag(tag, vr, length):
+        return tag > last_tag
+    if isinstance(path_or_file, (str, os.PathLike)):
+        with open(path_or_file, 'rb') as fp:
+            return pydicom.filereader.read_partial(fp, stop_when=past_last_tag, specific_tags=specific_tags)
+    return pydicom.filereader.read_partial(path_or_file, stop_when=past_last_tag, specific_tags=specific_tags)
+
+def read_dose_dataset(path_or_file, modality):
+    """Reads just the header tags the extractor for `modality` needs."""
+    tags = DOSE_TAGS_BY_MODALITY.get(modality)
+    if not tags:
+        return pydicom.dcmread(path_or_file, stop_before_pixels=True)
+    return read_header_tags(path_or_file, tags)
+
 def extract_dx_dose_info(ds):
     info = {}
     info['Patient ID'] = get_clean_value(ds, (0x0010, 0x0020))
@@ -189,7 +1006,188 @@ def validate_dx_parameters(info):
         validations['Exposure Status'] = exp_str
     return validations
 
+# CT scan event attributes read from each ExposureDoseSequence item: column -> (tag, VR).
+CT_EVENT_NUMERIC_TAGS = {
+    'ctdivol': (0x00189345, 'FD'),
+    'kvp': (0x00180060, 'DS'),
+    'tube_current_ua': (0x00188151, 'DS'),
+    'exposure_time': (0x00181150, 'IS'),
+    'pitch': (0x00189311, 'FD'),
+}
+CT_ACQUISITION_TYPE_TAG = 0x00189302
+CT_PHANTOM_SEQUENCE_TAG = 0x00189346
+CT_SCAN_TYPES = {'SEQUENCED': 'Axial', 'CONSTANT_ANGLE': 'Scout/Localizer', 'SPIRAL': 'Helical'}
+CT_PHANTOM_CODES = {'113690': 'Head 16cm', '113701': 'Head 16cm', '113691': 'Body 32cm', '113702': 'Body 32cm'}
+
+def _event_number(item, tag, vr):
+    """A numeric event attribute as float, or NaN when it is absent or not a single number."""
+    element = item.get_item(tag)
+    if element is None:
+        return np.nan
+    value = element.value
+    try:
+        if isinstance(value, bytes):
+            if (element.VR or vr) == 'FD':
+                return struct.unpack('<d' if element.is_little_endian else '>d', value)[0] \
+                    if len(value) == 8 else np.nan
+            value = value.strip(b' \x00')
+        return float(value) if value not in (None, b'', '') else np.nan
+    except (ValueError, TypeError, struct.error):
+        return np.nan
+
+def _event_text(item, tag):
+    element = item.get_item(tag)
+    value = element.value if element is not None else None
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'replace').strip(' \x00')
+    return value
+
+def _event_phantom(item):
+    sequence = item.get('CTDIPhantomTypeCodeSequence')
+    if not sequence:
+        return 'N/A'
+    return CT_PHANTOM_CODES.get(get_clean_value(sequence[0], 'CodeValue', '')) or \
+        get_clean_value(sequence[0], 'CodeMeaning', '')
+
+def _rounded(value, digits=None):
+    if np.isnan(value):
+        return ''
+    return int(round(value)) if digits is None else round(value, digits)
+
+class CTEventTable:
+    """The scan events of a CT dose report as columns, one entry per ExposureDoseSequence item."""
+
+    NUMERIC_COLUMNS = ('ctdivol', 'dlp', 'kvp', 'tube_current_ma', 'exposure_time', 'pitch')
+
+    def __init__(self, scan_type, phantom, **columns):
+        self.scan_type = np.asarray(scan_type, dtype=object)
+        self.phantom = np.asarray(phantom, dtype=object)
+        for name in self.NUMERIC_COLUMNS:
+            setattr(self, name, np.asarray(columns[name], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.scan_type)
+
+    @classmethod
+    def from_dataset(cls, ds, dlp_by_event=None):
+        """Reads ds.ExposureDoseSequence; `dlp_by_event` maps 1-based event numbers to DLP."""
+        items = ds.get('ExposureDoseSequence') or []
+        scan_types, phantoms, phantom_by_raw = [], [], {}
+        numbers = {name: [] for name in CT_EVENT_NUMERIC_TAGS}
+        for item in items:
+            acquisition_type = _event_text(item, CT_ACQUISITION_TYPE_TAG)
+            scan_types.append(CT_SCAN_TYPES.get(str(acquisition_type).upper(), str(acquisition_type))
+                              if acquisition_type else 'N/A')
+            # Events usually repeat one phantom; parse each distinct encoded sequence once.
+            element = item.get_item(CT_PHANTOM_SEQUENCE_TAG)
+            raw = element.value if element is not None and isinstance(element.value, bytes) else None
+            phantom = phantom_by_raw.get(raw) if raw is not None else None
+            if phantom is None:
+                phantom = _event_phantom(item)
+                if raw is not None:
+                    phantom_by_raw[raw] = phantom
+            phantoms.append(phantom)
+            for name, (tag, vr) in CT_EVENT_NUMERIC_TAGS.items():
+                numbers[name].append(_event_number(item, tag, vr))
+        dlp_by_event = dlp_by_event or {}
+        return cls(scan_types, phantoms,
+                   ctdivol=numbers['ctdivol'],
+                   dlp=[dlp_by_event.get(idx, np.nan) for idx in range(1, len(scan_types) + 1)],
+                   kvp=numbers['kvp'],
+                   tube_current_ma=np.asarray(numbers['tube_current_ua'], dtype=np.float64) / 1000.0,
+                   exposure_time=numbers['exposure_time'],
+                   pitch=numbers['pitch'])
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuilds a table stored with to_record()."""
+        return cls(record['scan_type'], record['phantom'],
+                   **{name: [np.nan if v is None else v for v in record[name]] for name in cls.NUMERIC_COLUMNS})
+
+    def to_record(self):
+        """The table as JSON-ready lists (NaN as None), for the report record."""
+        record = {'scan_type': self.scan_type.tolist(), 'phantom': self.phantom.tolist()}
+        for name in self.NUMERIC_COLUMNS:
+            values = getattr(self, name)
+            record[name] = np.where(np.isnan(values), None, values).tolist()
+        return record
+
+    def ctdivol_values(self):
+        """CTDIvol of every non-scout scan event that has one, rounded as displayed."""
+        mask = (self.scan_type != 'Scout/Localizer') & ~np.isnan(self.ctdivol)
+        return [round(value, 2) for value in self.ctdivol[mask].tolist()]
+
+    def rows(self):
+        """The events formatted for the report page."""
+        rows = []
+        columns = zip(self.scan_type.tolist(), self.phantom.tolist(), *(getattr(self, name).tolist()
+                                                                        for name in self.NUMERIC_COLUMNS))
+        for idx, (scan_type, phantom, ctdivol, dlp, kvp, tube_current, exposure_time, pitch) in enumerate(columns, 1):
+            scout = scan_type == 'Scout/Localizer'
+            rows.append({
+                'Series': idx, 'Type': scan_type,
+                'CTDIvol': '' if scout else _rounded(ctdivol, 2),
+                'DLP': '' if scout else _rounded(dlp, 2),
+                'Phantom': phantom,
+                'KVP': _rounded(kvp),
+                'XRayTubeCurrent': _rounded(tube_current),
+                'ExposureTime': _rounded(exposure_time),
+                'SpiralPitchFactor': _rounded(pitch, 3) if scan_type == 'Helical' else 'N/A'
+            })
+        return rows
+
+# Per-event and total DLP in CommentsOnRadiationDose, as written by different vendors:
+#   Siemens "TotalDLP=836.00 Event=1 DLP=101.00 Event=2 CTDIvol=5.2 DLP=102.00"
+#   GE/Canon "Total Exam DLP: 1234.56 mGy-cm", "Total DLP = 512.3 mGy*cm; Series 2 DLP: 250.1"
+#   SR-derived "CT Dose Length Product Total: 700.5 mGy.cm"
+# Only Event numbers are exposure event ordinals; Series/Scan numbers are not, so their DLPs only add up to
+# the total when no total is given. One alternation scans the comment once (the lookahead skips positions no
+# label can start at); the first total wins, a repeated event or series keeps its last DLP.
+CT_DOSE_COMMENT_PATTERN = re.compile(r"""(?=[EeSsTtDdCc])(?:
+    Event\s*(?:No\.?\s*)?[=:#]?\s*(?P<event>\d+)
+        (?:[\s,;]+(?!(?:DLP|Event|Series|Scan)\b)\w+\s*[=:]\s*[\w.]+)*
+        [\s,;]*DLP\s*[=:]\s*(?P<event_dlp>[\d.]+)
+  | \b(?:Series|Scan)\s*(?:No\.?\s*)?[=:#]?\s*(?P<series>\d+)
+        (?:[\s,;]+(?!(?:DLP|Event|Series|Scan)\b)\w+\s*[=:]\s*[\w.]+)*
+        [\s,;]*DLP\s*[=:]\s*(?P<series_dlp>[\d.]+)
+  | (?:Total\s*(?:Exam\s*)?DLP|\b(?:CT\s*)?Dose\s*Length\s*Product\s*Total|\bDLP\s*Total)
+        \s*[=:]\s*(?P<total>[\d.]+)
+)""", re.IGNORECASE | re.VERBOSE)
+CT_DOSE_COMMENT_CACHE_SIZE = 4096
+
+def _comment_number(text, what):
+    try:
+        return float(text)
+    except ValueError:
+        print(f"Warning: Could not parse {what} in CT comments: '{text}'")
+        return None
+
+@lru_cache(maxsize=CT_DOSE_COMMENT_CACHE_SIZE)
+def _parse_ct_dose_comments(comments):
+    events, series, total_dlp, total_seen = {}, {}, None, False
+    for event, event_dlp, series_number, series_dlp, total in CT_DOSE_COMMENT_PATTERN.findall(comments):
+        if event:
+            dlp = _comment_number(event_dlp, f'DLP of event {event}')
+            if dlp is not None:
+                events[int(event)] = dlp
+        elif series_number:
+            series[int(series_number)] = _comment_number(series_dlp, f'DLP of series {series_number}')
+        elif not total_seen:
+            total_seen = True
+            total_dlp = _comment_number(total, 'TotalDLP')
+    if not total_seen and series and None not in series.values():
+        total_dlp = sum(series.values())
+    return tuple(events.items()), total_dlp
+
+def parse_ct_dose_comments(comments):
+    """Per-event DLP ({event number: DLP}) and TotalDLP from CommentsOnRadiationDose."""
+    if not comments or not isinstance(comments, str):
+        return {}, None
+    events, total_dlp = _parse_ct_dose_comments(comments)
+    return dict(events), total_dlp
+
 def extract_ct_dose_info(ds):
+    """Study information, the CTEventTable of scan events and the TotalDLP of a CT dose report."""
     info = {
         'Patient ID': get_clean_value(ds, 'PatientID'),
         'Patient Age': get_clean_value(ds, 'PatientAge'),
@@ -198,88 +1196,12 @@ def extract_ct_dose_info(ds):
         'Study Description': get_clean_value(ds, 'StudyDescription'),
         'Series Description': get_clean_value(ds, 'SeriesDescription')
     }
-    comments = get_clean_value(ds, 'CommentsOnRadiationDose', '')
-    dlp_dict = {}
-    total_dlp = None 
-    if comments:
-        for match in re.finditer(r'Event=(\d+)\s*DLP=([\d.]+)', comments):
-            try:
-                event = int(match.group(1))
-                dlp = float(match.group(2))
-                dlp_dict[event] = dlp
-            except ValueError:
-                print(f"Warning: Could not parse DLP event in CT comments: '{match.group(0)}'")
-        total_match = re.search(r'TotalDLP=([\d.]+)', comments)
-        if total_match:
-            try:
-                total_dlp = float(total_match.group(1))
-            except ValueError:
-                print(f"Warning: Could not parse TotalDLP in CT comments: '{total_match.group(1)}'")
-                total_dlp = None 
-    results = []
-    if hasattr(ds, 'ExposureDoseSequence') and ds.ExposureDoseSequence:
-        for idx, item in enumerate(ds.ExposureDoseSequence, 1):
-            acq_type_val = getattr(item, 'AcquisitionType', None)
-            ctdi_vol_val = getattr(item, 'CTDIvol', None)
-            phantom = get_clean_value(item.CTDIPhantomTypeCodeSequence[0], 'CodeMeaning', '') \
-                if hasattr(item, 'CTDIPhantomTypeCodeSequence') and item.CTDIPhantomTypeCodeSequence \
-                else 'N/A'
-            if hasattr(item, 'CTDIPhantomTypeCodeSequence') and item.CTDIPhantomTypeCodeSequence:
-                code_val = get_clean_value(item.CTDIPhantomTypeCodeSequence[0], 'CodeValue', '')
-                if code_val in ['113690', '113701']: phantom = 'Head 16cm'
-                elif code_val in ['113691', '113702']: phantom = 'Body 32cm'
-            scan_type_str = 'N/A'
-            if acq_type_val:
-                acq_type_upper = str(acq_type_val).upper()
-                if acq_type_upper == 'SEQUENCED': scan_type_str = 'Axial'
-                elif acq_type_upper == 'CONSTANT_ANGLE': scan_type_str = 'Scout/Localizer'
-                elif acq_type_upper == 'SPIRAL': scan_type_str = 'Helical'
-                else: scan_type_str = str(acq_type_val)
-            ctdi_display = ''
-            if ctdi_vol_val is not None:
-                try: ctdi_display = round(float(ctdi_vol_val), 2)
-                except (ValueError, TypeError): ctdi_display = str(ctdi_vol_val)
-            dlp_for_event = dlp_dict.get(idx, None)
-            dlp_display = ''
-            if dlp_for_event is not None:
-                try: dlp_display = round(float(dlp_for_event), 2)
-                except (ValueError, TypeError): dlp_display = str(dlp_for_event)
-            kvp_val = getattr(item, 'KVP', None)
-            kvp_display = ''
-            if kvp_val is not None:
-                try: kvp_display = int(round(float(kvp_val)))
-                except (ValueError, TypeError): kvp_display = str(kvp_val)
-            tube_current_in_ua_val = getattr(item, 'XRayTubeCurrentInuA', None) 
-            tube_current_display_ma = '' 
-            if tube_current_in_ua_val is not None:
-                try:
-                    current_ma = float(tube_current_in_ua_val) / 1000.0
-                    tube_current_display_ma = int(round(current_ma)) 
-                except (ValueError, TypeError):
-                    tube_current_display_ma = str(tube_current_in_ua_val) 
-            exposure_time_val = getattr(item, 'ExposureTime', None)
-            exposure_time_display = ''
-            if exposure_time_val is not None:
-                try: exposure_time_display = int(round(float(exposure_time_val)))
-                except (ValueError, TypeError): exposure_time_display = str(exposure_time_val)
-            pitch_factor_val = getattr(item, 'SpiralPitchFactor', None)
-            pitch_factor_display = ''
-            if pitch_factor_val is not None and scan_type_str == 'Helical':
-                try: pitch_factor_display = round(float(pitch_factor_val), 3)
-                except (ValueError, TypeError): pitch_factor_display = str(pitch_factor_val)
-            elif scan_type_str != 'Helical':
-                pitch_factor_display = 'N/A'
-            results.append({
-                'Series': idx, 'Type': scan_type_str,
-                'CTDIvol': ctdi_display if scan_type_str != 'Scout/Localizer' else '',
-                'DLP': dlp_display if scan_type_str != 'Scout/Localizer' else '',
-                'Phantom': phantom,
-                'KVP': kvp_display,
-                'XRayTubeCurrent': tube_current_display_ma,
-                'ExposureTime': exposure_time_display,
-                'SpiralPitchFactor': pitch_factor_display
-            })
-    return info, results, total_dlp
+    dlp_dict, total_dlp = parse_ct_dose_comments(get_clean_value(ds, 'CommentsOnRadiationDose', ''))
+    return info, CTEventTable.from_dataset(ds, dlp_dict), total_dlp
+
+def ct_event_rows(report):
+    """Display rows of a stored CT report's scan events."""
+    return CTEventTable.from_record(report['ct_event_table']).rows()
 
 def extract_mg_dose_info(ds):
     """Extracts and processes dose-related information for MG modality."""
@@ -339,22 +1261,487 @@ def extract_mg_dose_info(ds):
     info['Anode Target Material'] = get_clean_value(ds, (0x0018, 0x1191), 'N/A') 
     return info
 
+# ==============================================================================
+# ==== DICOM INGESTION ====
+# ==============================================================================
+
+_INGEST_POOL = None
+_INGEST_JOB_RUNNER = None
+_INGEST_POOL_LOCK = threading.Lock()
+
+def worker_process_context():
+    """Start method for worker pools: never fork, since pools are first used from threads of a threaded server."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def _ingest_pool():
+    global _INGEST_POOL
+    with _INGEST_POOL_LOCK:
+        if _INGEST_POOL is None:
+            _INGEST_POOL = ProcessPoolExecutor(max_workers=app.config['INGEST_WORKERS'],
+                                               mp_context=worker_process_context())
+        return _INGEST_POOL
+
+def _reset_ingest_pool(pool):
+    """Drops a broken pool (one of its workers died) so the next _ingest_pool() call starts a new one."""
+    global _INGEST_POOL
+    with _INGEST_POOL_LOCK:
+        if _INGEST_POOL is pool:
+            _INGEST_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _ingest_job_runner():
+    global _INGEST_JOB_RUNNER
+    with _INGEST_POOL_LOCK:
+        if _INGEST_JOB_RUNNER is None:
+            _INGEST_JOB_RUNNER = ThreadPoolExecutor(max_workers=app.config['INGEST_JOB_THREADS'],
+                                                    thread_name_prefix='ingest-job')
+        return _INGEST_JOB_RUNNER
+
+def _modality_mismatch_error(original_filename, file_actual_modality, modality):
+    if modality == 'MG' and file_actual_modality != 'MG': 
+        return f"File '{original_filename}' is {file_actual_modality}, but {modality} (MG) selected. Skipped."
+    return f"File '{original_filename}' is {file_actual_modality}, but {modality} selected. Skipped."
+
+def inspect_upload(file_storage, original_filename, modality):
+    """(error, content_hash, sop_instance_uid) of an upload, read from its stream (left rewound) before saving."""
+    stream = file_storage.stream
+    try:
+        digest = hashlib.sha256()
+        for block in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(block)
+        stream.seek(0)
+        header = read_header_tags(stream, [(0x0008, 0x0018), (0x0008, 0x0060)])
+        stream.seek(0)
+    except pydicom.errors.InvalidDicomError:
+        return f"File '{original_filename}' is invalid/corrupted.", None, None
+    except Exception as e:
+        return f"Error processing '{original_filename}': {type(e).__name__} - {str(e)}", None, None
+    file_actual_modality = get_clean_value(header, 'Modality', 'UNKNOWN').upper()
+    if file_actual_modality != modality:
+        return _modality_mismatch_error(original_filename, file_actual_modality, modality), None, None
+    return None, digest.hexdigest(), get_clean_value(header, (0x0008, 0x0018), None)
+
+def ingest_dose_file(task):
+    """(report_data, error) for one saved upload, exactly one of them set; runs in the ingestion pool."""
+    temp_path, original_filename, unique_suffix, modality, content_hash = task
+    save_name = f"{unique_suffix}_{original_filename}"
+    try:
+        if content_hash is None:
+            content_hash = file_sha256(temp_path)
+        ds = read_dose_dataset(temp_path, modality)
+        file_actual_modality = get_clean_value(ds, 'Modality', 'UNKNOWN').upper()
+        if file_actual_modality != modality:
+            if os.path.exists(temp_path): os.remove(temp_path)
+            return None, _modality_mismatch_error(original_filename, file_actual_modality, modality)
+        main_info, ct_events, total_dlp_val = None, None, None
+        if modality == 'CT': main_info, ct_events, total_dlp_val = extract_ct_dose_info(ds)
+        elif modality == 'DX': main_info = extract_dx_dose_info(ds)
+        elif modality == 'MG': main_info = extract_mg_dose_info(ds)
+        else:
+            if os.path.exists(temp_path): os.remove(temp_path)
+            return None, f"Processing logic for modality '{modality}' not implemented for '{original_filename}'."
+        report_id = f"{unique_suffix}_{os.path.splitext(original_filename)[0]}"
+        report_data = {
+            'id': report_id, 'filename': original_filename, 'save_name': save_name, 'modality': modality,
+            'Patient ID': main_info.get('Patient ID', 'N/A'),
+            'Study Date': main_info.get('Study Date', 'N/A'), 
+            'Raw Study Date': get_clean_value(ds, (0x0008,0x0020)),
+            'sop_instance_uid': get_clean_value(ds, (0x0008, 0x0018), None),
+            'content_hash': content_hash
+        }
+        if modality == 'CT':
+            report_data.update({
+                'study_description': main_info.get('Study Description', 'N/A'),
+                'series_description': main_info.get('Series Description', 'N/A'),
+                'patient_age': main_info.get('Patient Age', 'N/A'),
+                'ct_info': main_info,
+                'ct_event_table': ct_events.to_record(),
+                'ctdivol_values': ct_events.ctdivol_values(),
+                'total_dlp': total_dlp_val
+            })
+        elif modality == 'DX':
+            report_data.update({
+                'body_part': main_info.get('Body Part Examined', 'N/A'), 
+                'view_position': main_info.get('View Position', 'N/A'),
+                'exposure': main_info.get('Exposure (mAs)', 'N/A'),
+                'kvp': main_info.get('kVp', 'N/A'),
+                TARGET_DAP_STORAGE_KEY_DX: main_info.get(TARGET_DAP_UNIT_LABEL_DX, 'N/A')
+            })
+        elif modality == 'MG':
+            report_data.update({
+                'study_description': main_info.get('Study Description', 'N/A'),
+                'series_description': main_info.get('Series Description', 'N/A'),
+                'body_part': main_info.get('Body Part Examined', 'N/A'), 
+                'view_position': main_info.get('View Position', 'N/A'),
+                TARGET_ORGAN_DOSE_STORAGE_KEY_MG: main_info.get(TARGET_ORGAN_DOSE_STORAGE_KEY_MG, 'N/A'),
+                'organ_exposed': main_info.get('Organ Exposed', 'N/A')
+            })
+        return report_data, None
+    except pydicom.errors.InvalidDicomError:
+        if os.path.exists(temp_path): os.remove(temp_path)
+        return None, f"File '{original_filename}' is invalid/corrupted."
+    except Exception as e:
+        if os.path.exists(temp_path): os.remove(temp_path)
+        return None, f"Error processing '{original_filename}': {type(e).__name__} - {str(e)}"
+
+def ingest_crashed(task, error):
+    """The ingest_dose_file result for a task whose worker process died while reading it."""
+    temp_path, original_filename = task[0], task[1]
+    if os.path.exists(temp_path): os.remove(temp_path)
+    return None, f"Error processing '{original_filename}': its worker process stopped ({type(error).__name__})."
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def fingerprint_dose_file(path):
+    """(path, content_hash, sop_instance_uid, modality, error) of a DICOM file on disk."""
+    try:
+        content_hash = file_sha256(path)
+        header = read_header_tags(path, [(0x0008, 0x0018), (0x0008, 0x0060)])
+        return (path, content_hash, get_clean_value(header, (0x0008, 0x0018), None),
+                get_clean_value(header, 'Modality', 'UNKNOWN').upper(), None)
+    except pydicom.errors.InvalidDicomError:
+        return path, None, None, None, f"File '{path}' is invalid/corrupted."
+    except Exception as e:
+        return path, None, None, None, f"Error processing '{path}': {type(e).__name__} - {str(e)}"
+
+def fingerprint_crashed(path, error):
+    return path, None, None, None, f"Error processing '{path}': its worker process stopped ({type(error).__name__})."
+
+def _run_tasks(func, tasks):
+    return [func(task) for task in tasks]
+
+def _run_task_alone(func, task, crashed):
+    """func(task) on the pool, on its own; a task whose worker dies is retried once on a new pool,
+    then reported by crashed(task, error)."""
+    for _ in range(2):
+        pool = _ingest_pool()
+        try:
+            return pool.submit(func, task).result()
+        except BrokenProcessPool as e:
+            error = e
+            _reset_ingest_pool(pool)
+    return crashed(task, error)
+
+def _map_on_ingest_pool(func, tasks, crashed):
+    """Maps func over tasks on the worker pool, yielding results in task order as soon as they are ready.
+
+    If a worker process dies (killed, or crashed in native code), the pool is replaced and the tasks not
+    finished yet are run one at a time, so only a task that keeps killing its worker is lost (as
+    crashed(task, error))."""
+    workers = app.config['INGEST_WORKERS']
+    if workers <= 1 or len(tasks) <= 1:
+        return (func(task) for task in tasks)
+    chunk_size = max(1, len(tasks) // (workers * 4))
+    return _map_chunks_on_ingest_pool(func, tasks, crashed, chunk_size)
+
+def _map_chunks_on_ingest_pool(func, tasks, crashed, chunk_size):
+    chunks = [tasks[start:start + chunk_size] for start in range(0, len(tasks), chunk_size)]
+    pool = _ingest_pool()
+    futures = []
+    try:
+        for chunk in chunks:
+            futures.append(pool.submit(_run_tasks, func, chunk))
+    except BrokenProcessPool:
+        pass
+    for index, chunk in enumerate(chunks):
+        try:
+            results = futures[index].result() if index < len(futures) else None
+        except (BrokenProcessPool, CancelledError):
+            results = None
+        if results is not None:
+            yield from results
+            continue
+        if pool is not None:
+            print("Ingestion worker pool broke; running the files it had not finished one at a time on a new pool.")
+            _reset_ingest_pool(pool)
+            pool = None
+        for task in chunk:
+            yield _run_task_alone(func, task, crashed)
+
+def ingest_dose_files(tasks):
+    """Yields the ingest_dose_file result of each task, in order, as soon as it is ready."""
+    return _map_on_ingest_pool(ingest_dose_file, tasks, ingest_crashed)
+
+def remove_report_file(report):
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], report['save_name'])
+    try:
+        if os.path.exists(file_path): os.remove(file_path)
+    except Exception as e:
+        print(f"Failed to delete {file_path}. Reason: {e}")
+
+def run_ingest_job(job_id, tasks, errors, replace_duplicates=False):
+    """Body of a background upload job: indexes every report as soon as it is parsed and records progress."""
+    processed_count = handled_count = 0
+    try:
+        REPORT_STORE.update_job(job_id, status='running')
+        for report_data, error in ingest_dose_files(tasks):
+            handled_count += 1
+            if error:
+                errors.append(error)
+            else:
+                replaced_reports = REPORT_STORE.add(report_data, replace_duplicates=replace_duplicates,
+                                                    skip_duplicates=not replace_duplicates)
+                if replaced_reports is None:
+                    # Indexed by another upload since the duplicate check in process_files.
+                    errors.append(f"File '{report_data['filename']}' is already indexed. Skipped.")
+                    remove_report_file(report_data)
+                    continue
+                for replaced_report in replaced_reports:
+                    remove_report_file(replaced_report)
+                processed_count += 1
+            REPORT_STORE.update_job(job_id, processed=processed_count, errors=errors)
+        REPORT_STORE.update_job(job_id, status='done')
+    except Exception as e:
+        print(f"Ingestion job {job_id} failed: {type(e).__name__} - {e}")
+        errors.append(f"Ingestion job stopped: {type(e).__name__} - {str(e)}")
+        REPORT_STORE.update_job(job_id, status='failed', errors=errors)
+        # Delete the uploads the job will never index: those not parsed yet, and the one it stopped on unless stored.
+        unfinished = tasks[max(handled_count - 1, 0):]
+        for save_name in REPORT_STORE.unindexed_save_names(f"{task[2]}_{task[1]}" for task in unfinished):
+            remove_report_file({'save_name': save_name})
+
+# ==============================================================================
+# ==== PLOT RENDERING ====
+# ==============================================================================
+
+# Look of the comparison bar charts. Charts are drawn on Figure objects with the Agg canvas directly,
+# never through pyplot's global state, so rendering is safe from any thread.
+BAR_CHART_TEMPLATE = {
+    'height': 6.5, 'min_width': 8, 'width_per_bar': 0.5, 'width_padding': 2,
+    'bar': {'color': '#5eaaa8', 'width': 0.6},
+    'label': {'fontsize': 12},
+    'title': {'fontsize': 14, 'fontweight': 'bold'},
+    'xticklabels': {'rotation': 45, 'ha': 'right', 'fontsize': 10},
+    'yticklabels': {'fontsize': 10},
+    'grid': {'axis': 'y', 'linestyle': ':', 'alpha': 0.7},
+    'layout_pad': 1.5,
+}
+
+_CHART_FIGURES = threading.local()
+_PLOT_POOL = None
+_PLOT_POOL_LOCK = threading.Lock()
+
+def _chart_figure():
+    """This thread's chart Figure, created once with its Agg canvas and cleared for every chart after that."""
+    figure = getattr(_CHART_FIGURES, 'figure', None)
+    if figure is None:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        _CHART_FIGURES.figure = figure
+    else:
+        figure.clear()
+    return figure
+
+def render_bar_chart(x_data, y_data, x_label, y_label, title):
+    """PNG bytes of a comparison bar chart drawn with BAR_CHART_TEMPLATE."""
+    template = BAR_CHART_TEMPLATE
+    figure = _chart_figure()
+    figure.set_size_inches(max(template['min_width'], len(x_data) * template['width_per_bar'] + template['width_padding']),
+                           template['height'])
+    axes = figure.add_subplot()
+    axes.bar(x_data, y_data, **template['bar'])
+    axes.set_xlabel(x_label, **template['label'])
+    axes.set_ylabel(y_label, **template['label'])
+    axes.set_title(title, **template['title'])
+    setp(axes.get_xticklabels(), **template['xticklabels'])
+    setp(axes.get_yticklabels(), **template['yticklabels'])
+    axes.grid(**template['grid'])
+    figure.tight_layout(pad=template['layout_pad'])
+    # tight_layout leaves a placeholder layout engine behind, which makes savefig draw the chart an extra time.
+    figure.set_layout_engine(None)
+    buffer = BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+# Percentiles noted under the title of a binned chart.
+CHART_PERCENTILES = (25, 50, 75, 95)
+
+def binned_chart_args(y_data, x_label, y_label, title, max_bins):
+    """Chart args for a histogram of y_data in at most max_bins bins, with n and percentiles in the title."""
+    values = np.asarray(y_data, dtype=float)
+    values = values[np.isfinite(values)]
+    if not values.size:
+        return [], [], y_label, f'{x_label} count', title
+    counts, edges = np.histogram(values, bins=max(1, min(max_bins, int(np.ceil(np.sqrt(values.size))))))
+    labels = [f'{low:.4g}–{high:.4g}' for low, high in zip(edges[:-1].tolist(), edges[1:].tolist())]
+    percentiles = np.percentile(values, CHART_PERCENTILES)
+    summary = ' · '.join([f'n = {values.size:,}'] + [f'p{p} {v:.4g}' for p, v in zip(CHART_PERCENTILES, percentiles)])
+    return labels, counts.tolist(), y_label, f'{x_label} count', f'{title}\n{summary}'
+
+def top_chart_args(x_data, y_data, x_label, y_label, title, max_bars):
+    """Chart args keeping the max_bars highest bars, in their original order, with the cut noted in the title."""
+    values = np.asarray(list(y_data), dtype=float)
+    kept = np.sort(np.argsort(-np.nan_to_num(values, nan=-np.inf), kind='stable')[:max_bars])
+    x_data = list(x_data)
+    return ([x_data[i] for i in kept], values[kept].tolist(), x_label, y_label,
+            f'{title}\n{len(kept)} highest of {values.size:,}')
+
+def _render_bar_chart_spec(spec):
+    return render_bar_chart(*spec)
+
+def _plot_pool():
+    global _PLOT_POOL
+    with _PLOT_POOL_LOCK:
+        if _PLOT_POOL is None:
+            _PLOT_POOL = ProcessPoolExecutor(max_workers=app.config['PLOT_WORKERS'],
+                                             mp_context=worker_process_context())
+        return _PLOT_POOL
+
+def _reset_plot_pool(pool):
+    """Drops a broken pool (one of its workers died) so the next _plot_pool() call starts a new one."""
+    global _PLOT_POOL
+    with _PLOT_POOL_LOCK:
+        if _PLOT_POOL is pool:
+            _PLOT_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _render_on_plot_pool(specs):
+    """PNG bytes or the exception for each spec; specs whose worker died are retried once on a new pool."""
+    outcomes, pending = [None] * len(specs), list(range(len(specs)))
+    for _ in range(2):
+        pool, futures = _plot_pool(), {}
+        for index in pending:
+            try:
+                futures[index] = pool.submit(_render_bar_chart_spec, specs[index])
+            except BrokenProcessPool as e:
+                outcomes[index] = e
+        for index, future in futures.items():
+            try:
+                outcomes[index] = future.result()
+            except Exception as e:
+                outcomes[index] = e
+        pending = [index for index in pending if isinstance(outcomes[index], (BrokenProcessPool, CancelledError))]
+        if not pending:
+            break
+        print(f"Plot worker pool broke; rendering {len(pending)} chart(s) on a new pool.")
+        _reset_plot_pool(pool)
+    return outcomes
+
+def render_bar_charts(specs):
+    """PNG bytes (None where rendering failed) for each chart spec, rendered on the plot workers."""
+    if app.config['PLOT_WORKERS'] <= 1 or len(specs) <= 1:
+        outcomes = []
+        for spec in specs:
+            try:
+                outcomes.append(render_bar_chart(*spec))
+            except Exception as e:
+                outcomes.append(e)
+    else:
+        outcomes = _render_on_plot_pool(specs)
+    results = []
+    for spec, outcome in zip(specs, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"Error rendering plot '{spec[4]}': {type(outcome).__name__} - {outcome}")
+            outcome = None
+        results.append(outcome)
+    return results
+
+# ==============================================================================
+# ==== PLOT CACHE ====
+# ==============================================================================
+
+class PlotCache:
+    """Size-bounded in-memory LRU of rendered plot PNGs, keyed by the hash of their inputs."""
+
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(*parts):
+        return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """The cached PNG bytes for `key`, or None."""
+        with self._lock:
+            png_bytes = self._entries.get(key)
+            if png_bytes is not None:
+                self._entries.move_to_end(key)
+            return png_bytes
+
+    def store(self, key, png_bytes):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old)
+            self._entries[key] = png_bytes
+            self._total_bytes += len(png_bytes)
+            while len(self._entries) > 1 and \
+                    (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+PLOT_CACHE = PlotCache(app.config['PLOT_CACHE_MAX_BYTES'], app.config['PLOT_CACHE_MAX_ENTRIES'])
+
 # ==============================================================================
 # ==== FLASK ROUTES ====
 # ==============================================================================
 
+def _store_version_etag():
+    """ETag of a store version, session modality, request path and query, and the chart settings."""
+    parts = [REPORT_STORE.version(), session.get('modality'), request.path, sorted(request.args.items(multi=True)),
+             app.config['CLIENT_SIDE_CHARTS'], app.config['CHART_MAX_BARS']]
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:32]
+
+def conditional_on_store_version(view):
+    """Answers with 304, without running view, while the browser's copy matches _store_version_etag."""
+    @wraps(view)
+    def conditional_view(*args, **kwargs):
+        if session.get('_flashes'):
+            # Pending flash messages are shown by the next page, which must then really be rendered.
+            return view(*args, **kwargs)
+        etag = _store_version_etag()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return conditional_view
+
+_JOBS_RECOVERED_PID = None
+_JOBS_RECOVERY_LOCK = threading.Lock()
+
+@app.before_request
+def recover_orphaned_jobs():
+    """Before a worker's first request: fails jobs whose runner died with its worker and deletes their uploads."""
+    global _JOBS_RECOVERED_PID
+    if _JOBS_RECOVERED_PID == os.getpid():
+        return
+    with _JOBS_RECOVERY_LOCK:
+        if _JOBS_RECOVERED_PID != os.getpid():
+            for save_name in REPORT_STORE.fail_orphaned_jobs():
+                remove_report_file({'save_name': save_name})
+            _JOBS_RECOVERED_PID = os.getpid()
+
 @app.route('/', methods=['GET', 'POST'])
 def select_modality():
-    modalities = ['CT', 'DX', 'MG'] 
+    modalities = MODALITIES
     if request.method == 'POST':
         selected_modality = request.form.get('modality')
         if selected_modality in modalities:
             current_session_modality = session.get('modality')
             if current_session_modality != selected_modality:
-                REPORT_INDEX.clear()
-                clear_folder(app.config['UPLOAD_FOLDER'], extensions_to_delete=['.dcm'])
-                clear_folder(STATIC_FOLDER, extensions_to_delete=['.png']) 
-                flash(f"Data cleared. Modality switched to {selected_modality}.", "info")
+                # Reports are kept per modality, so switching only changes which ones are shown.
+                flash(f"Modality switched to {selected_modality} ({REPORT_STORE.count(selected_modality)} report(s) indexed).", "info")
             else:
                  flash(f"Modality {selected_modality} re-confirmed.", "info")
             session['modality'] = selected_modality
@@ -381,79 +1768,74 @@ def process_files():
     if not uploaded_files or all(f.filename == '' for f in uploaded_files):
         flash("No files were selected for upload.", "warning")
         return redirect(url_for('index'))
-    errors, processed_count = [], 0
+    on_duplicate = request.form.get('on_duplicate') or app.config['DUPLICATE_UPLOAD_POLICY']
+    replace_duplicates = on_duplicate == 'replace'
+    errors, ingest_tasks, batch_fingerprints = [], [], set()
     for file_storage in uploaded_files: 
         if not file_storage.filename: continue
         if not allowed_file(file_storage.filename):
             errors.append(f"File '{file_storage.filename}' has an invalid extension. Only .dcm allowed.")
             continue
         original_filename = secure_filename(file_storage.filename)
+        header_error, content_hash, sop_instance_uid = inspect_upload(file_storage, original_filename, modality)
+        if header_error:
+            errors.append(header_error)
+            continue
+        if content_hash in batch_fingerprints or (sop_instance_uid and sop_instance_uid in batch_fingerprints):
+            errors.append(f"File '{original_filename}' appears more than once in this upload. Skipped.")
+            continue
+        batch_fingerprints.update(fp for fp in (content_hash, sop_instance_uid) if fp)
+        if not replace_duplicates:
+            duplicate = REPORT_STORE.find_duplicate(content_hash, sop_instance_uid)
+            if duplicate:
+                errors.append(f"File '{original_filename}' is already indexed as '{duplicate['filename']}'. Skipped.")
+                continue
         unique_suffix = uuid.uuid4().hex[:8]
         save_name = f"{unique_suffix}_{original_filename}"
         temp_path = os.path.join(app.config['UPLOAD_FOLDER'], save_name)
         try:
             file_storage.save(temp_path)
-            ds = pydicom.dcmread(temp_path, stop_before_pixels=True)
-            file_actual_modality = get_clean_value(ds, 'Modality', 'UNKNOWN').upper()
-            if file_actual_modality != modality:
-                expected_modality_in_file = modality
-                if modality == 'MG' and file_actual_modality != 'MG': 
-                     errors.append(f"File '{original_filename}' is {file_actual_modality}, but {modality} (MG) selected. Skipped.")
-                else:
-                    errors.append(f"File '{original_filename}' is {file_actual_modality}, but {modality} selected. Skipped.")
-                if os.path.exists(temp_path): os.remove(temp_path)
-                continue
-            main_info = None 
-            if modality == 'CT': main_info, _, _ = extract_ct_dose_info(ds)
-            elif modality == 'DX': main_info = extract_dx_dose_info(ds)
-            elif modality == 'MG': main_info = extract_mg_dose_info(ds)
-            else:
-                errors.append(f"Processing logic for modality '{modality}' not implemented for '{original_filename}'.")
-                if os.path.exists(temp_path): os.remove(temp_path)
-                continue
-            report_id = f"{unique_suffix}_{os.path.splitext(original_filename)[0]}"
-            report_data = {
-                'id': report_id, 'filename': original_filename, 'save_name': save_name, 'modality': modality,
-                'Patient ID': main_info.get('Patient ID', 'N/A'),
-                'Study Date': main_info.get('Study Date', 'N/A'), 
-                'Raw Study Date': get_clean_value(ds, (0x0008,0x0020)) 
-            }
-            if modality == 'CT':
-                report_data.update({
-                    'study_description': main_info.get('Study Description', 'N/A'),
-                    'series_description': main_info.get('Series Description', 'N/A'),
-                    'patient_age': main_info.get('Patient Age', 'N/A')
-                })
-            elif modality == 'DX':
-                report_data.update({
-                    'body_part': main_info.get('Body Part Examined', 'N/A'), 
-                    'view_position': main_info.get('View Position', 'N/A'),
-                    'exposure': main_info.get('Exposure (mAs)', 'N/A'),
-                    'kvp': main_info.get('kVp', 'N/A'),
-                    TARGET_DAP_STORAGE_KEY_DX: main_info.get(TARGET_DAP_UNIT_LABEL_DX, 'N/A')
-                })
-            elif modality == 'MG':
-                report_data.update({
-                    'study_description': main_info.get('Study Description', 'N/A'),
-                    'series_description': main_info.get('Series Description', 'N/A'),
-                    'body_part': main_info.get('Body Part Examined', 'N/A'), 
-                    'view_position': main_info.get('View Position', 'N/A'),
-                    TARGET_ORGAN_DOSE_STORAGE_KEY_MG: main_info.get(TARGET_ORGAN_DOSE_STORAGE_KEY_MG, 'N/A'),
-                    'organ_exposed': main_info.get('Organ Exposed', 'N/A')
-                })
-            REPORT_INDEX.append(report_data)
-            processed_count += 1
-        except pydicom.errors.InvalidDicomError:
-            errors.append(f"File '{original_filename}' is invalid/corrupted.")
-            if os.path.exists(temp_path): os.remove(temp_path)
         except Exception as e:
             errors.append(f"Error processing '{original_filename}': {type(e).__name__} - {str(e)}")
             if os.path.exists(temp_path): os.remove(temp_path)
-    if errors: flash('; '.join(errors), 'error')
-    if processed_count > 0: flash(f"Successfully processed {processed_count} {modality} file(s).", 'success')
-    elif not errors and any(fs.filename for fs in uploaded_files): 
-        flash("No files were processed successfully. Check errors or modality match.", "warning")
-    return redirect(url_for('list_reports'))
+            continue
+        ingest_tasks.append((temp_path, original_filename, unique_suffix, modality, content_hash))
+    if not ingest_tasks:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'error': "No files were accepted for processing.", 'errors': errors}), 400
+        if errors: flash('; '.join(errors), 'error')
+        else: flash("No files were processed successfully. Check errors or modality match.", "warning")
+        return redirect(url_for('list_reports'))
+    job_id = uuid.uuid4().hex
+    REPORT_STORE.create_job(job_id, modality, total=len(ingest_tasks) + len(errors), errors=errors,
+                            save_names=[os.path.basename(task[0]) for task in ingest_tasks])
+    _ingest_job_runner().submit(run_ingest_job, job_id, ingest_tasks, list(errors), replace_duplicates)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job_id, 'status_url': url_for('ingest_job_status', job_id=job_id)}), 202
+    flash(f"Upload accepted: {len(ingest_tasks)} {modality} file(s) queued for processing.", 'info')
+    return redirect(url_for('list_reports', job=job_id))
+
+@app.route('/jobs/<job_id>')
+def ingest_job_status(job_id):
+    job = REPORT_STORE.get_job(job_id)
+    if not job:
+        return jsonify({'error': f"Ingestion job '{job_id}' not found."}), 404
+    return jsonify(job)
+
+# Report list fields (REPORT_SEARCH_FIELDS) searched for every modality, plus per-modality extras.
+LIST_SEARCH_FIELDS = {
+    'base': ['filename', 'patient_id', 'study_date', 'raw_study_date'],
+    'CT': ['study_description'],
+    'DX': ['body_part', 'view_position'],
+    'MG': ['study_description', 'body_part', 'view_position', 'organ_exposed'],
+}
+# Report list sort keys -> REPORT_SORT_COLUMNS; unknown keys keep upload order.
+LIST_SORT_COLUMNS = {
+    'filename': 'filename', 'Patient ID': 'patient_id', 'Study Date': 'study_date_int',
+    'study_description': 'study_description', 'series_description': 'series_description',
+    'body_part': 'body_part', 'view_position': 'view_position', 'organ_exposed': 'organ_exposed',
+    'total_dlp': 'dose', TARGET_DAP_STORAGE_KEY_DX: 'dose', TARGET_ORGAN_DOSE_STORAGE_KEY_MG: 'dose',
+}
 
 @app.route('/reports')
 def list_reports():
@@ -467,102 +1849,26 @@ def list_reports():
     sort_order = request.args.get('sort_order', 'desc') 
     if sort_order not in ['asc', 'desc']:
         sort_order = 'desc'
-    relevant_reports = [r for r in REPORT_INDEX if r['modality'] == modality_filter]
-    if search_term:
-        matching_report_ids = set()
-        temp_filtered_reports = []
-        for r in relevant_reports:
-            matches_base = search_term in r['filename'].lower() or \
-                           search_term in r.get('Patient ID', '').lower() or \
-                           search_term in r.get('Study Date', '').lower() or \
-                           search_term in r.get('Raw Study Date', '').lower()
-            matches_modality_specific = False
-            if r['modality'] == 'CT' and search_term in r.get('study_description', '').lower():
-                matches_modality_specific = True
-            elif r['modality'] == 'DX' and \
-                 (search_term in r.get('body_part', '').lower() or \
-                  search_term in r.get('view_position', '').lower()):
-                matches_modality_specific = True
-            elif r['modality'] == 'MG' and \
-                 (search_term in r.get('study_description', '').lower() or \
-                  search_term in r.get('body_part', '').lower() or \
-                  search_term in r.get('view_position', '').lower() or \
-                  search_term in r.get('organ_exposed', '').lower()):
-                matches_modality_specific = True
-            if (matches_base or matches_modality_specific) and r['id'] not in matching_report_ids:
-                temp_filtered_reports.append(r)
-                matching_report_ids.add(r['id'])
-        final_filtered_reports = temp_filtered_reports
-    else:
-        final_filtered_reports = relevant_reports
-    if final_filtered_reports: 
-        is_reverse = (sort_order == 'desc')
-        def sort_key_func(report):
-            val = report.get(sort_by)
-            if val is None: 
-                return float('-inf') if sort_order == 'asc' else float('inf')
-            if sort_by == TARGET_DAP_STORAGE_KEY_DX: 
-                try:
-                    val_str = str(val).lower()
-                    if "invalid" in val_str or "n/a" in val_str:
-                        return float('-inf') if sort_order == 'asc' else float('inf')
-                    return float(val)
-                except (ValueError, TypeError): 
-                    return float('-inf') if sort_order == 'asc' else float('inf')
-            if sort_by == TARGET_ORGAN_DOSE_STORAGE_KEY_MG:
-                try:
-                    val_str = str(val).lower()
-                    if "invalid" in val_str or "n/a" in val_str:
-                        return float('-inf') if sort_order == 'asc' else float('inf')
-                    return float(val)
-                except (ValueError, TypeError):
-                    return float('-inf') if sort_order == 'asc' else float('inf')
-            if sort_by == 'Study Date' and 'Raw Study Date' in report:
-                 raw_date = report.get('Raw Study Date')
-                 if raw_date and str(raw_date).isdigit() and len(str(raw_date)) == 8:
-                     return raw_date
-                 return val if val is not None else (float('-inf') if sort_order == 'asc' else float('inf'))
-            if isinstance(val, str):
-                return val.lower() 
-            return val
-        try:
-            final_filtered_reports.sort(key=sort_key_func, reverse=is_reverse)
-        except TypeError as e:
-            flash(f"Could not sort by '{sort_by}'. Ensure data types are consistent or add specific handling. Error: {e}", "warning")
-            pass
-    total = len(final_filtered_reports)
+    search_fields = LIST_SEARCH_FIELDS['base'] + LIST_SEARCH_FIELDS.get(modality_filter, [])
+    sort_column = LIST_SORT_COLUMNS.get(sort_by, 'seq')
+    sorted_reports = REPORT_STORE.sorted_view(modality_filter, sort_column, search_term, search_fields)
+    total = len(sorted_reports)
     pages = (total + PER_PAGE - 1) // PER_PAGE if PER_PAGE > 0 else 1
     if page < 1: page = 1
     if page > pages and pages > 0: page = pages
-    start_index = (page - 1) * PER_PAGE
-    end_index = start_index + PER_PAGE
-    reports_on_page = final_filtered_reports[start_index:end_index]
-    study_descriptions_ct = []
+    # Reports missing the sort value come first either way; an unknown sort key leaves upload order.
+    reports_on_page = REPORT_STORE.by_seq(sorted_reports.page(
+        (page - 1) * PER_PAGE, PER_PAGE, descending=(sort_order == 'desc' and sort_column != 'seq')
+    ))
+    study_descriptions_ct, body_parts_dx_or_mg, organ_exposed_mg, mg_view_positions = [], [], [], []
     if modality_filter == 'CT':
-        study_descriptions_ct = sorted(list(set(
-            r['study_description'] for r in relevant_reports 
-            if r.get('study_description') and r.get('study_description','N/A') != 'N/A'
-        )))
-    body_parts_dx_or_mg = [] 
-    if modality_filter == 'DX' or modality_filter == 'MG': 
-        body_parts_dx_or_mg = sorted(list(set(
-            r['body_part'] for r in relevant_reports 
-            if r.get('body_part') and r.get('body_part','N/A') != 'N/A'
-        )))
-
-    organ_exposed_mg = []
-    mg_view_positions = [] # Initialize this list
-
+        study_descriptions_ct = REPORT_STORE.distinct_values('CT', 'study_description')
+    if modality_filter in ('DX', 'MG'):
+        body_parts_dx_or_mg = REPORT_STORE.distinct_values(modality_filter, 'body_part')
     if modality_filter == 'MG':
-        organ_exposed_mg = sorted(list(set(
-            r['organ_exposed'] for r in relevant_reports
-            if r.get('organ_exposed') and r.get('organ_exposed', 'N/A') != 'N/A'
-        )))
-        # Gather unique view positions for MG to be used in quick links
-        mg_view_positions = sorted(list(set(
-            r['view_position'] for r in relevant_reports
-            if r.get('view_position') and r.get('view_position', 'N/A') != 'N/A'
-        )))
+        organ_exposed_mg = REPORT_STORE.distinct_values('MG', 'organ_exposed')
+        # Unique view positions for MG, used in quick links
+        mg_view_positions = REPORT_STORE.distinct_values('MG', 'view_position')
 
     return render_template(
         'report_list.html', reports=reports_on_page, page=page, pages=pages,
@@ -576,21 +1882,17 @@ def list_reports():
         TARGET_ORGAN_DOSE_UNIT_LABEL_MG=TARGET_ORGAN_DOSE_UNIT_LABEL_MG,
         PER_PAGE=PER_PAGE,
         current_sort_by=sort_by,
-        current_sort_order=sort_order
+        current_sort_order=sort_order,
+        ingest_job_id=request.args.get('job')
     )
 
 
 @app.route('/delete_file/<report_id>', methods=['POST'])
 def delete_file(report_id):
-    report_to_delete, index_to_remove = None, -1
-    for i, report_item in enumerate(REPORT_INDEX):
-        if report_item['id'] == report_id:
-            report_to_delete, index_to_remove = report_item, i
-            break
+    report_to_delete = REPORT_STORE.delete(report_id)
     if not report_to_delete:
         flash(f"Report ID '{report_id}' not found.", 'error')
     else:
-        del REPORT_INDEX[index_to_remove]
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], report_to_delete['save_name'])
         if os.path.exists(file_path):
             try:
@@ -604,9 +1906,23 @@ def delete_file(report_id):
     search = request.form.get('search', '')
     return redirect(url_for('list_reports', page=page, search=search))
 
+@app.route('/clear_reports', methods=['POST'])
+def clear_reports():
+    """Removes every report of the session's modality, with its uploaded file; other modalities are kept."""
+    modality = session.get('modality')
+    if not modality:
+        flash("Please select a modality first.", "warning")
+        return redirect(url_for('select_modality'))
+    save_names = REPORT_STORE.clear(modality)
+    for save_name in save_names:
+        if save_name:
+            remove_report_file({'save_name': save_name})
+    flash(f"Cleared {len(save_names)} {modality} report(s).", 'info')
+    return redirect(url_for('list_reports'))
+
 @app.route('/report/<report_id>')
 def view_report(report_id):
-    report_meta = next((r for r in REPORT_INDEX if r['id'] == report_id), None)
+    report_meta = REPORT_STORE.get(report_id)
     if not report_meta:
         flash(f"Report with ID '{report_id}' not found.", 'error')
         return redirect(url_for('list_reports'))
@@ -625,20 +1941,19 @@ def view_report(report_id):
     }
     try:
         dicom_file_path = os.path.join(app.config['UPLOAD_FOLDER'], report_meta['save_name'])
-        if not os.path.exists(dicom_file_path):
+        if report_meta['modality'] == 'CT':
+            # CT details were extracted once at upload time; no need to re-read the DICOM.
+            template_context['info'] = report_meta['ct_info']
+            template_context['data'] = ct_event_rows(report_meta)
+            template_context['total_dlp'] = report_meta['total_dlp']
+        elif not os.path.exists(dicom_file_path):
             msg = f"DICOM file '{report_meta['filename']}' (saved as '{report_meta['save_name']}') not found on disk."
             errors_list.append(msg)
-            if report_meta['modality'] == 'CT': template_context['info'] = report_meta
-            elif report_meta['modality'] == 'DX': template_context['dx_info'] = report_meta
+            if report_meta['modality'] == 'DX': template_context['dx_info'] = report_meta
             elif report_meta['modality'] == 'MG': template_context['mg_info'] = report_meta
         else:
-            ds = pydicom.dcmread(dicom_file_path, stop_before_pixels=True)
-            if report_meta['modality'] == 'CT':
-                ct_info_details, ct_series_data, total_dlp_val = extract_ct_dose_info(ds)
-                template_context['info'] = ct_info_details
-                template_context['data'] = ct_series_data
-                template_context['total_dlp'] = total_dlp_val
-            elif report_meta['modality'] == 'DX':
+            ds = read_dose_dataset(dicom_file_path, report_meta['modality'])
+            if report_meta['modality'] == 'DX':
                 dx_info_details = extract_dx_dose_info(ds)
                 template_context['dx_info'] = dx_info_details
             elif report_meta['modality'] == 'MG':
@@ -667,75 +1982,289 @@ def view_report(report_id):
     return render_template('results.html', **template_context)
 
 # --- Comparison and Export Routes ---
-def _generate_comparison_plot(x_data, y_data, x_label, y_label, title_prefix, group_name):
-    plt.figure(figsize=(max(8, len(x_data) * 0.5 + 2), 6.5))
-    plt.bar(x_data, y_data, color='#5eaaa8', width=0.6) 
-    plt.xlabel(x_label, fontsize=12)
-    plt.ylabel(y_label, fontsize=12)
-    plt.title(f'{title_prefix} for {group_name}', fontsize=14, fontweight='bold')
-    plt.xticks(rotation=45, ha="right", fontsize=10)
-    plt.yticks(fontsize=10)
-    plt.grid(axis='y', linestyle=':', alpha=0.7)
-    plt.tight_layout(pad=1.5)
-    safe_group_name = re.sub(r'[^a-zA-Z0-9_.-]', '_', group_name)
-    plot_filename_base = title_prefix.lower().replace(" ", "_").replace("(", "").replace(")", "").replace("·","")
-    plot_filename = f'{plot_filename_base}_{safe_group_name}_{uuid.uuid4().hex[:6]}.png'
-    plot_path = os.path.join(STATIC_FOLDER, plot_filename)
-    try:
-        plt.savefig(plot_path)
-        return url_for('static', filename=plot_filename)
-    except Exception as e:
-        print(f"Error saving plot {plot_filename}: {e}")
+def _chart_value(value):
+    """A chart value as plain JSON: numpy scalars become Python numbers and NaN becomes null."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
         return None
-    finally:
-        plt.close()
+    return value
+
+def _generate_comparison_plots(plot_args, distributions=False):
+    """/plot/<key> URLs (None where rendering failed) for a page's charts, also added to g.charts.
+    With distributions (a bar per patient), large groups are binned; other charts keep their highest bars."""
+    client_side = app.config['CLIENT_SIDE_CHARTS']
+    plot_urls, charts, to_render, specs = [], [], [], {}
+    max_bars = app.config['CHART_MAX_BARS']
+    for x_data, y_data, x_label, y_label, title_prefix, group_name in plot_args:
+        title = f'{title_prefix} for {group_name}'
+        if len(y_data) > max_bars and distributions:
+            spec = binned_chart_args(y_data, x_label, y_label, title, max_bars)
+        else:
+            if len(y_data) > max_bars:
+                x_data, y_data, x_label, y_label, title = top_chart_args(x_data, y_data, x_label, y_label, title,
+                                                                         max_bars)
+            spec = ([_chart_value(x) for x in x_data], [_chart_value(y) for y in y_data], x_label, y_label, title)
+        x_data, y_data, x_label, y_label, title = spec
+        key = PlotCache.key_for(*spec)
+        plot_urls.append(url_for('plot_image', key=key))
+        charts.append({'key': key, 'plot_url': plot_urls[-1], 'title': title, 'x_label': x_label,
+                       'y_label': y_label, 'x': x_data, 'y': y_data})
+        if client_side:
+            specs[key] = spec
+        elif PLOT_CACHE.get(key) is None:
+            to_render.append((len(plot_urls) - 1, key, spec))
+    pngs = render_bar_charts([spec for _, _, spec in to_render])
+    for (index, key, spec), png in zip(to_render, pngs):
+        if png is None:
+            plot_urls[index] = None
+            charts[index]['plot_url'] = None
+        else:
+            PLOT_CACHE.store(key, png)
+            specs[key] = spec
+    _record_plot_specs(specs)
+    g.setdefault('charts', []).extend(charts)
+    return plot_urls
+
+_RECORDED_PLOT_KEYS = OrderedDict()
+_RECORDED_PLOT_KEYS_LOCK = threading.Lock()
+
+def _record_plot_specs(specs):
+    """Saves the specs this worker hasn't saved recently, so re-viewing a page doesn't write them again."""
+    with _RECORDED_PLOT_KEYS_LOCK:
+        new_specs = {key: spec for key, spec in specs.items() if key not in _RECORDED_PLOT_KEYS}
+        for key in specs:
+            _RECORDED_PLOT_KEYS[key] = True
+            _RECORDED_PLOT_KEYS.move_to_end(key)
+        while len(_RECORDED_PLOT_KEYS) > PLOT_SPEC_MAX_ENTRIES // 2:
+            _RECORDED_PLOT_KEYS.popitem(last=False)
+    REPORT_STORE.save_plot_specs(new_specs)
+
+def _render_comparison_page(template_name, **context):
+    """The comparison page, or with ?format=json just its charts (columnar x/y series) and flash messages."""
+    if request.args.get('format') == 'json':
+        return jsonify({'charts': g.get('charts', []),
+                        'messages': [{'category': category, 'message': message}
+                                     for category, message in get_flashed_messages(with_categories=True)]})
+    return render_template(template_name, **context)
+
+def _generate_comparison_plot(x_data, y_data, x_label, y_label, title_prefix, group_name, distribution=False):
+    return _generate_comparison_plots([(x_data, y_data, x_label, y_label, title_prefix, group_name)],
+                                      distributions=distribution)[0]
+
+@app.route('/plot/<key>')
+def plot_image(key):
+    """A comparison chart PNG from this worker's PLOT_CACHE, rendered from its recorded spec on a miss."""
+    if key in request.if_none_match:
+        response = Response(status=304)
+    else:
+        png = PLOT_CACHE.get(key)
+        if png is None:
+            spec = REPORT_STORE.plot_spec(key)
+            if spec is None:
+                return "Plot not found.", 404
+            png = render_bar_charts([spec])[0]
+            if png is None:
+                return "Plot could not be rendered.", 500
+            PLOT_CACHE.store(key, png)
+        response = Response(png, mimetype='image/png')
+    response.set_etag(key)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['PLOT_MAX_AGE']
+    return response
+
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+EXPORT_BATCH_ROWS = 10000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Per-report export rows, read straight from the typed `reports` columns; the dose is the 5th column.
+EXPORT_REPORT_COLUMNS = {
+    'CT': ('study_description', 'patient_id', 'filename', 'modality', 'dose', 'study_date_display'),
+    'DX': ('body_part', 'patient_id', 'filename', 'modality', 'dose', 'study_date_display'),
+}
+# Sheet grouping of the bulk exports, as SQL so rows arrive grouped; matches the comparison pages
+# (Study Description as stored, Body Part upper-cased and stripped), with blanks under 'N/A'.
+CT_EXPORT_GROUP_SQL = "COALESCE(NULLIF(study_description, ''), 'N/A')"
+DX_EXPORT_GROUP_SQL = "COALESCE(NULLIF(upper(trim(body_part)), ''), 'N/A')"
+
+def _export_rows(rows):
+    for row in rows:
+        yield row[:4] + ('N/A' if row[4] is None else row[4], row[5] or '')
 
 def _create_excel_export(df, sheet_name, download_base_filename):
+    """Exports a (summary) DataFrame through _stream_export; missing values are written as empty cells."""
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    numeric_columns = [column for column, dtype in df.dtypes.items()
+                       if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)]
+    return _stream_export(list(df.columns), rows, sheet_name, download_base_filename, numeric_columns)
+
+def _stream_export(columns, rows, sheet_name, download_base_filename, numeric_columns=()):
+    """Streams rows as an xlsx, csv or parquet download (?format=); None after flashing an error.
+    numeric_columns are typed float64 in parquet (other columns are strings)."""
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        flash(f"Unknown export format '{export_format}'.", "error")
+        return None
+    safe_filename_suffix = re.sub(r'[^a-zA-Z0-9_.-]', '_', sheet_name)
+    download_filename = f'{download_base_filename}_{safe_filename_suffix}.{export_format}'
+    headers = {'Content-Disposition': f'attachment; filename="{download_filename}"'}
+    if export_format == 'csv':
+        return Response(stream_with_context(_csv_chunks(columns, rows)),
+                        mimetype=EXPORT_FORMATS['csv'], headers=headers)
+    if export_format == 'parquet' and pq is None:
+        flash("Parquet export needs the 'pyarrow' package to be installed.", "error")
+        return None
+    fd, temp_path = tempfile.mkstemp(suffix=f'.{export_format}')
+    os.close(fd)
     try:
-        output_stream = BytesIO()
-        df.to_excel(output_stream, index=False, sheet_name=sheet_name)
-        output_stream.seek(0)
-        safe_filename_suffix = re.sub(r'[^a-zA-Z0-9_.-]', '_', sheet_name) 
-        download_filename = f'{download_base_filename}_{safe_filename_suffix}.xlsx'
-        return send_file(
-            output_stream, as_attachment=True, download_name=download_filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        if export_format == 'xlsx':
+            _write_xlsx(temp_path, columns, rows, sheet_name)
+        else:
+            _write_parquet(temp_path, columns, rows, numeric_columns)
+    except Exception as e:
+        os.remove(temp_path)
+        flash(f"Error generating {export_format} file: {e}", "error")
+        return None
+    headers['Content-Length'] = str(os.path.getsize(temp_path))
+    return Response(_file_chunks(temp_path), mimetype=EXPORT_FORMATS[export_format], headers=headers)
+
+def _csv_chunks(columns, rows):
+    buffer = StringIO()
+    buffer.write('\ufeff')  # BOM, so Excel opens the UTF-8 file with the right encoding
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def _xlsx_sheet_title(name, used_titles):
+    """A valid, unique (case-insensitively, like Excel) sheet title derived from `name`."""
+    base = re.sub(r'[\[\]:*?/\\]', '_', str(name)).strip()[:31] or 'Sheet'
+    title, n = base, 1
+    while title.lower() in used_titles:
+        n += 1
+        title = f'{base[:31 - len(f" ({n})")]} ({n})'
+    used_titles.add(title.lower())
+    return title
+
+def _xlsx_header(worksheet, columns):
+    header = []
+    for column in columns:
+        cell = WriteOnlyCell(worksheet, value=column)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    worksheet.append(header)
+
+def _write_xlsx(path, columns, rows, sheet_name):
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=_xlsx_sheet_title(sheet_name, set()))
+    _xlsx_header(worksheet, columns)
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(path)
+
+def _write_grouped_xlsx(path, columns, grouped_rows, summary_columns, summary_rows):
+    """Writes a sheet per group of the sorted (group, row) pairs, plus a Summary sheet placed first."""
+    workbook = openpyxl.Workbook(write_only=True)
+    used_titles = {'summary'}
+    current_group, worksheet = object(), None
+    for group, row in grouped_rows:
+        if group != current_group:
+            current_group = group
+            worksheet = workbook.create_sheet(title=_xlsx_sheet_title(group, used_titles))
+            _xlsx_header(worksheet, columns)
+        worksheet.append(row)
+    summary_sheet = workbook.create_sheet(title='Summary', index=0)
+    _xlsx_header(summary_sheet, summary_columns)
+    for row in summary_rows():
+        summary_sheet.append(row)
+    workbook.save(path)
+
+def _send_grouped_xlsx(download_filename, columns, grouped_rows, summary_columns, summary_rows):
+    """Builds a _write_grouped_xlsx workbook in a temporary file and streams it; None (after flashing) on error."""
+    fd, temp_path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        _write_grouped_xlsx(temp_path, columns, grouped_rows, summary_columns, summary_rows)
     except Exception as e:
+        os.remove(temp_path)
         flash(f"Error generating Excel file: {e}", "error")
         return None
+    headers = {'Content-Disposition': f'attachment; filename="{download_filename}"',
+               'Content-Length': str(os.path.getsize(temp_path))}
+    return Response(_file_chunks(temp_path), mimetype=EXPORT_FORMATS['xlsx'], headers=headers)
+
+def _write_parquet(path, columns, rows, numeric_columns=()):
+    """Writes rows to a parquet file in EXPORT_BATCH_ROWS row groups, with numeric_columns as float64 (None and
+    'N/A' as null) and the rest as strings; a non-numeric value in a numeric column raises ValueError."""
+    schema = pa.schema([(column, pa.float64() if column in numeric_columns else pa.string()) for column in columns])
+    batch = []
+    def parquet_value(value, column, is_numeric):
+        if value is None or (is_numeric and value == 'N/A'):
+            return None
+        if not is_numeric:
+            return str(value)
+        if isinstance(value, numbers.Real) and not isinstance(value, bool):
+            return float(value)
+        raise ValueError(f"Column '{column}' is numeric, but a row holds {value!r}.")
+    def flush():
+        arrays = [pa.array([parquet_value(v, field.name, field.type == pa.float64()) for v in values], field.type)
+                  for field, values in zip(schema, zip(*batch))]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        batch.clear()
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                flush()
+        if batch:
+            flush()
+
+def _file_chunks(path):
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(EXPORT_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
 
 # CT Comparison Routes (compare_dlp, export_excel_filtered, mean_dlp_comparison, export_mean_dlp_excel, mean_ctdivol_comparison, export_mean_ctdivol_excel)
 # These remain unchanged as they are CT-specific.
 # ... (Existing CT comparison and export routes from your app.py) ...
 @app.route('/compare_dlp')
+@conditional_on_store_version
 def compare_dlp():
     if session.get('modality') != 'CT':
         flash("DLP Comparison is for CT modality only.", "warning")
         return redirect(url_for('list_reports'))
-    ct_reports = [r for r in REPORT_INDEX if r['modality'] == 'CT']
+    ct_reports = REPORT_STORE.reports('CT')
     if not ct_reports:
         flash("No CT reports uploaded to compare DLP.", "info")
-        return render_template('compare_dlp.html', plots=[], tables=[], study_descriptions=[], current_modality='CT')
+        return _render_comparison_page('compare_dlp.html', plots=[], tables=[], study_descriptions=[], current_modality='CT')
     records = []
     for report_meta in ct_reports:
-        try:
-            dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], report_meta['save_name'])
-            if not os.path.exists(dicom_path): continue
-            ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-            _, _, total_dlp_val = extract_ct_dose_info(ds) 
-            if total_dlp_val is not None and report_meta.get('study_description', 'N/A') != 'N/A':
-                records.append({
-                    'Study Description': report_meta.get('study_description', '').strip(),
-                    'Patient ID': report_meta.get('Patient ID', 'N/A'),
-                    'report_id': report_meta['id'], 'filename': report_meta['filename'],
-                    'Total DLP': total_dlp_val, 'study_date': report_meta.get('Study Date', '')
-                })
-        except Exception as e:
-            print(f"Error processing '{report_meta['filename']}' for DLP comparison: {e}")
+        total_dlp_val = report_meta.get('total_dlp')
+        if total_dlp_val is not None and report_meta.get('study_description', 'N/A') != 'N/A':
+            records.append({
+                'Study Description': report_meta.get('study_description', '').strip(),
+                'Patient ID': report_meta.get('Patient ID', 'N/A'),
+                'report_id': report_meta['id'], 'filename': report_meta['filename'],
+                'Total DLP': total_dlp_val, 'study_date': report_meta.get('Study Date', '')
+            })
     if not records:
         flash("No CT reports with valid DLP data for comparison.", "info")
-        return render_template('compare_dlp.html', plots=[], tables=[], study_descriptions=[], current_modality='CT')
+        return _render_comparison_page('compare_dlp.html', plots=[], tables=[], study_descriptions=[], current_modality='CT')
     df_all = pd.DataFrame(records)
     plots, tables = [], []
     study_descs_for_page = sorted(list(df_all['Study Description'].unique()))
@@ -743,19 +2272,21 @@ def compare_dlp():
     df_to_plot = df_all[df_all['Study Description'] == selected_filter].copy() if selected_filter else df_all.copy()
     if df_to_plot.empty and selected_filter:
         flash(f"No data for Study Description: {selected_filter}", "info")
+    plot_groups, plot_args = [], []
     for group_name, group_data in df_to_plot.groupby('Study Description'):
         if group_data.empty or group_data['Total DLP'].isnull().all(): continue
-        plot_url = _generate_comparison_plot(
-            group_data['Patient ID'], group_data['Total DLP'],
-            'Patient ID', 'Total DLP (mGy·cm)', 'Total DLP', group_name
-        )
-        if plot_url: plots.append({'study': group_name, 'plot_url': plot_url})
+        plot_groups.append(group_name)
+        plot_args.append((group_data['Patient ID'], group_data['Total DLP'],
+                          'Patient ID', 'Total DLP (mGy·cm)', 'Total DLP', group_name))
         tables.append({'study': group_name, 'table': group_data.to_dict(orient='records')})
-    return render_template('compare_dlp.html', plots=plots, tables=tables, 
-                           study_descriptions=study_descs_for_page, 
-                           selected_study=selected_filter, current_modality='CT')
+    for group_name, plot_url in zip(plot_groups, _generate_comparison_plots(plot_args, distributions=True)):
+        if plot_url: plots.append({'study': group_name, 'plot_url': plot_url})
+    return _render_comparison_page('compare_dlp.html', plots=plots, tables=tables, 
+                                   study_descriptions=study_descs_for_page, 
+                                   selected_study=selected_filter, current_modality='CT')
 
 @app.route('/export_excel_filtered')
+@conditional_on_store_version
 def export_excel_filtered():
     if session.get('modality') != 'CT':
         flash("Excel export for CT only.", "error")
@@ -764,82 +2295,87 @@ def export_excel_filtered():
     if not study_desc_filter:
         flash("Select Study Description for export.", "warning")
         return redirect(url_for('compare_dlp'))
-    records = []
-    for r_meta in filter(lambda r: r['modality'] == 'CT' and r.get('study_description','').strip() == study_desc_filter, REPORT_INDEX):
-        try:
-            dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], r_meta['save_name'])
-            if not os.path.exists(dicom_path): continue
-            ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-            _, _, total_dlp_val = extract_ct_dose_info(ds)
-            records.append({
-                'Study Description': r_meta.get('study_description', ''), 'Patient ID': r_meta.get('Patient ID', 'N/A'),
-                'Filename': r_meta.get('filename', ''), 'Modality': r_meta.get('modality', ''),
-                'Total DLP (mGy.cm)': total_dlp_val if total_dlp_val is not None else 'N/A',
-                'Study Date': r_meta.get('Study Date', '')
-            })
-        except Exception as e: print(f"Error for Excel export (CT): {r_meta['filename']} - {e}")
-    if not records:
+    rows = _export_rows(REPORT_STORE.iter_columns('CT', EXPORT_REPORT_COLUMNS['CT'], study_description=study_desc_filter))
+    first_row = next(rows, None)
+    if first_row is None:
         flash(f"No data for export: {study_desc_filter}", "info")
         return redirect(url_for('compare_dlp'))
-    response = _create_excel_export(pd.DataFrame(records), study_desc_filter, "CT_DLP_Export")
+    response = _stream_export(['Study Description', 'Patient ID', 'Filename', 'Modality', 'Total DLP (mGy.cm)', 'Study Date'],
+                              itertools.chain([first_row], rows), study_desc_filter, "CT_DLP_Export",
+                              numeric_columns=['Total DLP (mGy.cm)'])
+    return response if response else redirect(url_for('compare_dlp'))
+
+@app.route('/export_ct_all_excel')
+@conditional_on_store_version
+def export_ct_all_excel():
+    """Every CT report in one workbook: a sheet per Study Description plus the mean DLP/CTDIvol summary."""
+    if session.get('modality') != 'CT':
+        flash("Excel export for CT only.", "error")
+        return redirect(url_for('list_reports'))
+    if not REPORT_STORE.count('CT'):
+        flash("No CT reports data to export.", "info")
+        return redirect(url_for('compare_dlp'))
+    rows = _export_rows(REPORT_STORE.iter_columns('CT', EXPORT_REPORT_COLUMNS['CT'], order_by=CT_EXPORT_GROUP_SQL))
+    def summary_rows():
+        for row in REPORT_STORE.ct_study_aggregates():
+            mean_dlp = row['dlp_sum'] / row['dlp_count'] if row['dlp_count'] else None
+            mean_ctdivol = row['ctdivol_sum'] / row['event_count'] if row['event_count'] else None
+            yield (row['study_description'] or 'N/A', row['report_count'],
+                   round(mean_dlp, 2) if mean_dlp is not None else 'N/A', row['dlp_count'],
+                   round(mean_ctdivol, 2) if mean_ctdivol is not None else 'N/A', row['event_count'])
+    response = _send_grouped_xlsx(
+        'CT_DLP_Export_All.xlsx',
+        ['Study Description', 'Patient ID', 'Filename', 'Modality', 'Total DLP (mGy.cm)', 'Study Date'],
+        ((row[0] or 'N/A', row) for row in rows),
+        ['Study Description', 'Number of Reports', 'Mean Total DLP (mGy.cm)', 'Reports with Total DLP',
+         'Mean CTDIvol (mGy per scan event)', 'Total Scan Events Used'],
+        summary_rows
+    )
     return response if response else redirect(url_for('compare_dlp'))
 
+def _mean_dlp_summaries():
+    """Mean Total DLP per Study Description, from the store's running CT aggregates."""
+    return [{'study_description': row['study_description'],
+             'mean_dlp': row['dlp_sum'] / row['dlp_count'],
+             'number_of_reports': row['dlp_count']}
+            for row in REPORT_STORE.ct_study_aggregates() if row['dlp_count']]
+
+def _mean_ctdivol_summaries():
+    """Mean CTDIvol per scan event for each Study Description, from the store's running CT aggregates."""
+    return [{'study_description': row['study_description'],
+             'mean_ctdivol': row['ctdivol_sum'] / row['event_count'] if row['event_count'] else None,
+             'number_of_reports': row['report_count'],
+             'total_scan_events': row['event_count']}
+            for row in REPORT_STORE.ct_study_aggregates()]
+
 @app.route('/mean_dlp_comparison')
+@conditional_on_store_version
 def mean_dlp_comparison():
     if session.get('modality') != 'CT':
         flash("Mean DLP Comparison is for CT modality only.", "warning")
         return redirect(url_for('list_reports'))
-    ct_reports = [r for r in REPORT_INDEX if r['modality'] == 'CT']
-    if not ct_reports:
+    if not REPORT_STORE.count('CT'):
         flash("No CT reports uploaded to calculate Mean DLP.", "info")
-        return render_template('mean_dlp_comparison.html',
-                               study_data_with_means=[],
-                               study_descriptions=[],
-                               selected_study=None,
-                               current_modality='CT',
-                               current_sort_by='study_description',
-                               current_sort_order='asc',
-                               plot_url_mean_dlp=None)
-    records_for_dlp = []
-    for report_meta in ct_reports:
-        try:
-            dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], report_meta['save_name'])
-            if not os.path.exists(dicom_path): continue
-            ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-            _, _, total_dlp_val = extract_ct_dose_info(ds) 
-            raw_study_date = get_clean_value(ds, (0x0008,0x0020))
-            if report_meta.get('study_description', 'N/A') != 'N/A' and total_dlp_val is not None:
-                records_for_dlp.append({
-                    'Study Description': report_meta.get('study_description', '').strip(),
-                    'Total DLP': total_dlp_val, 
-                    'report_count_placeholder': 1, 
-                    'Patient ID': report_meta.get('Patient ID', 'N/A'),
-                    'study_date': report_meta.get('Study Date', ''),
-                    'raw_study_date': raw_study_date if raw_study_date and str(raw_study_date).isdigit() and len(str(raw_study_date)) == 8 else None,
-                    'filename': report_meta.get('filename', '')
-                })
-        except Exception as e:
-            print(f"Error processing '{report_meta['filename']}' for Mean DLP calculation: {e}")
-    if not records_for_dlp:
+        return _render_comparison_page('mean_dlp_comparison.html',
+                                       study_data_with_means=[],
+                                       study_descriptions=[],
+                                       selected_study=None,
+                                       current_modality='CT',
+                                       current_sort_by='study_description',
+                                       current_sort_order='asc',
+                                       plot_url_mean_dlp=None)
+    study_summary_list_dlp = _mean_dlp_summaries()
+    if not study_summary_list_dlp:
         flash("No CT reports with valid Total DLP data.", "info")
-        return render_template('mean_dlp_comparison.html',
-                               study_data_with_means=[],
-                               study_descriptions=[],
-                               selected_study=None,
-                               current_modality='CT',
-                               current_sort_by='study_description',
-                               current_sort_order='asc',
-                               plot_url_mean_dlp=None)
-    df_dlp = pd.DataFrame(records_for_dlp)
-    study_summary_list_dlp = []
-    for study_desc, group in df_dlp.groupby('Study Description'):
-        mean_dlp_val = group['Total DLP'].mean() if not group['Total DLP'].empty else None
-        num_reports = group['report_count_placeholder'].sum()
-        study_summary_list_dlp.append({
-            'study_description': study_desc,
-            'mean_dlp': mean_dlp_val,
-            'number_of_reports': num_reports
-        })
+        return _render_comparison_page('mean_dlp_comparison.html',
+                                       study_data_with_means=[],
+                                       study_descriptions=[],
+                                       selected_study=None,
+                                       current_modality='CT',
+                                       current_sort_by='study_description',
+                                       current_sort_order='asc',
+                                       plot_url_mean_dlp=None)
+    all_study_descriptions_dlp = [item['study_description'] for item in study_summary_list_dlp]
     sort_by = request.args.get('sort_by', 'study_description')
     sort_order = request.args.get('sort_order', 'asc')
     if sort_order not in ['asc', 'desc']:
@@ -859,7 +2395,6 @@ def mean_dlp_comparison():
         study_summary_list_dlp.sort(key=sort_key_dlp_summary, reverse=is_reverse)
     except TypeError as e:
         flash(f"Could not sort DLP summary data by '{sort_by}'. Error: {e}", "warning")
-    all_study_descriptions_dlp = sorted(list(df_dlp['Study Description'].unique()))
     selected_study_filter_dlp = request.args.get('study_desc_filter')
     data_for_page = study_summary_list_dlp
     if selected_study_filter_dlp:
@@ -879,51 +2414,34 @@ def mean_dlp_comparison():
                     title_prefix='Mean Total DLP Comparison',
                     group_name=selected_study_filter_dlp if selected_study_filter_dlp else 'All Studies'
                 ) 
-    return render_template('mean_dlp_comparison.html', 
-                           study_data_with_means=data_for_page,
-                           study_descriptions=all_study_descriptions_dlp,
-                           selected_study=selected_study_filter_dlp,
-                           current_modality='CT',
-                           current_sort_by=sort_by,
-                           current_sort_order=sort_order,
-                           plot_url_mean_dlp=plot_url_mean_dlp)
+    return _render_comparison_page('mean_dlp_comparison.html', 
+                                   study_data_with_means=data_for_page,
+                                   study_descriptions=all_study_descriptions_dlp,
+                                   selected_study=selected_study_filter_dlp,
+                                   current_modality='CT',
+                                   current_sort_by=sort_by,
+                                   current_sort_order=sort_order,
+                                   plot_url_mean_dlp=plot_url_mean_dlp)
 
 @app.route('/export_mean_dlp_excel')
+@conditional_on_store_version
 def export_mean_dlp_excel():
     if session.get('modality') != 'CT':
         flash("Excel export for Mean DLP is for CT modality only.", "error")
         return redirect(url_for('list_reports'))
-    ct_reports = [r for r in REPORT_INDEX if r['modality'] == 'CT']
-    if not ct_reports:
+    if not REPORT_STORE.count('CT'):
         flash("No CT reports data to export.", "info")
         return redirect(url_for('mean_dlp_comparison'))
-    records_for_dlp_export = []
-    for report_meta in ct_reports:
-        try:
-            dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], report_meta['save_name'])
-            if not os.path.exists(dicom_path): continue
-            ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-            _, _, total_dlp_val = extract_ct_dose_info(ds) 
-            if report_meta.get('study_description', 'N/A') != 'N/A' and total_dlp_val is not None:
-                records_for_dlp_export.append({
-                    'Study Description': report_meta.get('study_description', '').strip(),
-                    'Total DLP': total_dlp_val,
-                    'report_count_placeholder': 1
-                })
-        except Exception as e:
-            print(f"Error processing '{report_meta['filename']}' for Excel export (Mean DLP): {e}")
-    if not records_for_dlp_export:
+    summaries = _mean_dlp_summaries()
+    if not summaries:
         flash("No valid Total DLP data to export.", "info")
         return redirect(url_for('mean_dlp_comparison'))
-    df_dlp_export = pd.DataFrame(records_for_dlp_export)
     study_summary_for_excel_dlp = []
-    for study_desc, group in df_dlp_export.groupby('Study Description'):
-        mean_dlp_val = group['Total DLP'].mean() if not group['Total DLP'].empty else None
-        num_reports = group['report_count_placeholder'].sum()
+    for item in summaries:
         study_summary_for_excel_dlp.append({
-            'Study Description': study_desc,
-            'Mean Total DLP (mGy.cm)': round(mean_dlp_val, 2) if mean_dlp_val is not None else 'N/A',
-            'Number of Reports': num_reports
+            'Study Description': item['study_description'],
+            'Mean Total DLP (mGy.cm)': round(item['mean_dlp'], 2) if item['mean_dlp'] is not None else 'N/A',
+            'Number of Reports': item['number_of_reports']
         })
     if not study_summary_for_excel_dlp:
         flash("No summary DLP data to export to Excel.", "info")
@@ -942,71 +2460,33 @@ def export_mean_dlp_excel():
     return response if response else redirect(url_for('mean_dlp_comparison'))
 
 @app.route('/mean_ctdivol_comparison')
+@conditional_on_store_version
 def mean_ctdivol_comparison():
     if session.get('modality') != 'CT':
         flash("Mean CTDIvol Comparison is for CT modality only.", "warning")
         return redirect(url_for('list_reports'))
-    ct_reports = [r for r in REPORT_INDEX if r['modality'] == 'CT']
-    if not ct_reports: 
+    if not REPORT_STORE.count('CT'):
         flash("No CT reports uploaded to calculate Mean CTDIvol.", "info")
-        return render_template('mean_ctdivol_comparison.html',
-                               study_data_with_means=[],
-                               study_descriptions=[],
-                               selected_study=None,
-                               current_modality='CT',
-                               current_sort_by='study_description',
-                               current_sort_order='asc',
-                               plot_url_mean_ctdivol=None) 
-    records_for_ctdivol = []
-    for report_meta in ct_reports:
-        try:
-            dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], report_meta['save_name'])
-            if not os.path.exists(dicom_path): continue
-            ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-            _, ct_series_data, _ = extract_ct_dose_info(ds) 
-            ctdivol_values_for_report = []
-            if ct_series_data:
-                for event_item in ct_series_data:
-                    if event_item.get('Type') != 'Scout/Localizer' and \
-                       event_item.get('CTDIvol') not in [None, '', 'N/A']:
-                        try:
-                            ctdivol_values_for_report.append(float(event_item['CTDIvol']))
-                        except (ValueError, TypeError):
-                            pass
-            if report_meta.get('study_description', 'N/A') != 'N/A':
-                records_for_ctdivol.append({
-                    'Study Description': report_meta.get('study_description', '').strip(),
-                    'ctdivol_events': ctdivol_values_for_report,
-                    'report_count_placeholder': 1 
-                })
-        except Exception as e:
-            print(f"Error processing '{report_meta['filename']}' for Mean CTDIvol calculation: {e}")
-    if not records_for_ctdivol:
+        return _render_comparison_page('mean_ctdivol_comparison.html',
+                                       study_data_with_means=[],
+                                       study_descriptions=[],
+                                       selected_study=None,
+                                       current_modality='CT',
+                                       current_sort_by='study_description',
+                                       current_sort_order='asc',
+                                       plot_url_mean_ctdivol=None) 
+    study_summary_list = _mean_ctdivol_summaries()
+    if not study_summary_list:
         flash("No CT reports with valid CTDIvol data.", "info")
-        return render_template('mean_ctdivol_comparison.html',
-                               study_data_with_means=[],
-                               study_descriptions=[],
-                               selected_study=None,
-                               current_modality='CT',
-                               current_sort_by='study_description',
-                               current_sort_order='asc',
-                               plot_url_mean_ctdivol=None) 
-    df_ctdivol = pd.DataFrame(records_for_ctdivol)
-    study_summary_list = []
-    for study_desc, group in df_ctdivol.groupby('Study Description'):
-        all_events_for_study = []
-        for event_list in group['ctdivol_events']:
-            all_events_for_study.extend(event_list)
-        mean_val = None
-        if all_events_for_study:
-            mean_val = sum(all_events_for_study) / len(all_events_for_study)
-        num_reports = group['report_count_placeholder'].sum()
-        study_summary_list.append({
-            'study_description': study_desc,
-            'mean_ctdivol': mean_val,
-            'number_of_reports': num_reports,
-            'total_scan_events': len(all_events_for_study)
-        })
+        return _render_comparison_page('mean_ctdivol_comparison.html',
+                                       study_data_with_means=[],
+                                       study_descriptions=[],
+                                       selected_study=None,
+                                       current_modality='CT',
+                                       current_sort_by='study_description',
+                                       current_sort_order='asc',
+                                       plot_url_mean_ctdivol=None) 
+    all_study_descriptions = [item['study_description'] for item in study_summary_list]
     sort_by = request.args.get('sort_by', 'study_description')
     sort_order = request.args.get('sort_order', 'asc')
     if sort_order not in ['asc', 'desc']: sort_order = 'asc'
@@ -1025,7 +2505,6 @@ def mean_ctdivol_comparison():
         study_summary_list.sort(key=sort_key_summary, reverse=is_reverse)
     except TypeError as e:
         flash(f"Could not sort summary data by '{sort_by}'. Error: {e}", "warning")
-    all_study_descriptions = sorted(list(df_ctdivol['Study Description'].unique()))
     selected_study_filter = request.args.get('study_desc_filter')
     data_for_chart_and_table = study_summary_list
     if selected_study_filter:
@@ -1045,66 +2524,35 @@ def mean_ctdivol_comparison():
                     title_prefix='Mean CTDIvol Comparison',
                     group_name=selected_study_filter if selected_study_filter else 'All Studies'
                 ) 
-    return render_template('mean_ctdivol_comparison.html',
-                           study_data_with_means=data_for_chart_and_table, 
-                           study_descriptions=all_study_descriptions,
-                           selected_study=selected_study_filter,
-                           current_modality='CT',
-                           current_sort_by=sort_by,
-                           current_sort_order=sort_order,
-                           plot_url_mean_ctdivol=plot_url_mean_ctdivol) 
+    return _render_comparison_page('mean_ctdivol_comparison.html',
+                                   study_data_with_means=data_for_chart_and_table, 
+                                   study_descriptions=all_study_descriptions,
+                                   selected_study=selected_study_filter,
+                                   current_modality='CT',
+                                   current_sort_by=sort_by,
+                                   current_sort_order=sort_order,
+                                   plot_url_mean_ctdivol=plot_url_mean_ctdivol) 
 
 @app.route('/export_mean_ctdivol_excel')
+@conditional_on_store_version
 def export_mean_ctdivol_excel():
     if session.get('modality') != 'CT':
         flash("Excel export for Mean CTDIvol is for CT modality only.", "error")
         return redirect(url_for('list_reports'))
-    ct_reports = [r for r in REPORT_INDEX if r['modality'] == 'CT']
-    if not ct_reports:
+    if not REPORT_STORE.count('CT'):
         flash("No CT reports data to export.", "info")
         return redirect(url_for('mean_ctdivol_comparison'))
-    records_for_ctdivol = []
-    for report_meta in ct_reports:
-        try:
-            dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], report_meta['save_name'])
-            if not os.path.exists(dicom_path): continue
-            ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-            _, ct_series_data, _ = extract_ct_dose_info(ds) 
-            ctdivol_values_for_report = []
-            if ct_series_data:
-                for event_item in ct_series_data:
-                    if event_item.get('Type') != 'Scout/Localizer' and \
-                       event_item.get('CTDIvol') not in [None, '', 'N/A']:
-                        try:
-                            ctdivol_values_for_report.append(float(event_item['CTDIvol']))
-                        except (ValueError, TypeError):
-                            pass
-            if report_meta.get('study_description', 'N/A') != 'N/A':
-                records_for_ctdivol.append({
-                    'Study Description': report_meta.get('study_description', '').strip(),
-                    'ctdivol_events': ctdivol_values_for_report,
-                    'report_count_placeholder': 1
-                })
-        except Exception as e:
-            print(f"Error processing '{report_meta['filename']}' for Excel export (Mean CTDIvol): {e}")
-    if not records_for_ctdivol:
+    summaries = _mean_ctdivol_summaries()
+    if not summaries:
         flash("No valid CTDIvol data to export.", "info")
         return redirect(url_for('mean_ctdivol_comparison'))
-    df_ctdivol = pd.DataFrame(records_for_ctdivol)
     study_summary_for_excel = []
-    for study_desc, group in df_ctdivol.groupby('Study Description'):
-        all_events_for_study = []
-        for event_list in group['ctdivol_events']:
-            all_events_for_study.extend(event_list)
-        mean_val = None
-        if all_events_for_study:
-            mean_val = sum(all_events_for_study) / len(all_events_for_study)
-        num_reports = group['report_count_placeholder'].sum()
+    for item in summaries:
         study_summary_for_excel.append({
-            'Study Description': study_desc,
-            'Mean CTDIvol (mGy per scan event)': round(mean_val, 2) if mean_val is not None else 'N/A',
-            'Number of Reports': num_reports,
-            'Total Scan Events Used': len(all_events_for_study)
+            'Study Description': item['study_description'],
+            'Mean CTDIvol (mGy per scan event)': round(item['mean_ctdivol'], 2) if item['mean_ctdivol'] is not None else 'N/A',
+            'Number of Reports': item['number_of_reports'],
+            'Total Scan Events Used': item['total_scan_events']
         })
     if not study_summary_for_excel:
         flash("No summary data to export to Excel.", "info")
@@ -1126,59 +2574,50 @@ def export_mean_ctdivol_excel():
 # These remain unchanged as they are DX-specific.
 # ... (Existing DX comparison and export routes from your app.py) ...
 @app.route('/compare_dap')
+@conditional_on_store_version
 def compare_dap():
     if session.get('modality') != 'DX':
         flash("DAP Comparison is for DX modality only.", "warning")
         return redirect(url_for('list_reports'))
-    dx_reports = [r for r in REPORT_INDEX if r['modality'] == 'DX']
-    if not dx_reports:
+    dx_df = REPORT_STORE.frame('DX')
+    if dx_df.empty:
         flash("No DX reports uploaded to compare DAP.", "info")
-        return render_template('compare_dap.html', plots=[], tables=[], body_parts_examined=[], current_modality='DX')
-    records = []
-    for r_meta in dx_reports:
-        dap_val_str = r_meta.get(TARGET_DAP_STORAGE_KEY_DX, 'N/A')
-        dap_val_num = None
-        if not str(dap_val_str).lower().startswith('n/a'):
-            try: dap_val_num = float(dap_val_str)
-            except ValueError: print(f"Could not parse DAP '{dap_val_str}' for {r_meta['filename']}")
-        if dap_val_num is not None and r_meta.get('body_part') and r_meta.get('body_part','N/A') != 'N/A':
-            records.append({
-                'Body Part Examined': r_meta.get('body_part','').strip().upper(), 
-                'Patient ID': r_meta.get('Patient ID', 'N/A'), 'report_id': r_meta['id'],
-                'filename': r_meta['filename'], TARGET_DAP_UNIT_LABEL_DX: dap_val_num,
-                'study_date': r_meta.get('Study Date', '')
-            })
-    if not records:
+        return _render_comparison_page('compare_dap.html', plots=[], tables=[], body_parts_examined=[], current_modality='DX')
+    body_parts = dx_df['body_part'].astype('object')
+    valid = dx_df['dose'].notna() & body_parts.notna() & (body_parts != '') & (body_parts != 'N/A')
+    if not valid.any():
         flash("No DX reports with valid DAP and Body Part for comparison.", "info")
-        return render_template('compare_dap.html', plots=[], tables=[], body_parts_examined=[], current_modality='DX')
-    df_all = pd.DataFrame(records)
-    df_all[TARGET_DAP_UNIT_LABEL_DX] = pd.to_numeric(df_all[TARGET_DAP_UNIT_LABEL_DX], errors='coerce')
-    df_all.dropna(subset=[TARGET_DAP_UNIT_LABEL_DX], inplace=True)
-    if df_all.empty:
-        flash("No numeric DAP data after filtering.", "info")
-        return render_template('compare_dap.html', plots=[], tables=[], body_parts_examined=[], current_modality='DX')
+        return _render_comparison_page('compare_dap.html', plots=[], tables=[], body_parts_examined=[], current_modality='DX')
+    df_all = pd.DataFrame({
+        'Body Part Examined': body_parts[valid].str.strip().str.upper(),
+        'Patient ID': dx_df.loc[valid, 'patient_id'], 'report_id': dx_df.loc[valid, 'id'],
+        'filename': dx_df.loc[valid, 'filename'], TARGET_DAP_UNIT_LABEL_DX: dx_df.loc[valid, 'dose'],
+        'study_date': dx_df.loc[valid, 'study_date'].fillna('')
+    })
     plots, tables = [], []
     body_parts_for_page = sorted(list(df_all['Body Part Examined'].unique()))
     selected_filter = request.args.get('body_part_filter')
     df_to_process = df_all[df_all['Body Part Examined'] == selected_filter].copy() if selected_filter else df_all.copy()
     if df_to_process.empty and selected_filter: flash(f"No data for Body Part: {selected_filter}", "info")
+    agg_label = "Average"
+    plot_groups, plot_args = [], []
     for group_name, group_exams in df_to_process.groupby('Body Part Examined'):
         if group_exams.empty or group_exams[TARGET_DAP_UNIT_LABEL_DX].isnull().all(): continue
         agg_dap = group_exams.groupby('Patient ID')[TARGET_DAP_UNIT_LABEL_DX].mean().reset_index()
-        agg_label = "Average"
         if agg_dap.empty: continue
-        plot_url = _generate_comparison_plot(
-            agg_dap['Patient ID'], agg_dap[TARGET_DAP_UNIT_LABEL_DX],
-            'Patient ID', f'{agg_label} {TARGET_DAP_UNIT_LABEL_DX}', f'{agg_label} DAP', group_name
-        )
-        if plot_url: plots.append({'body_part': group_name, 'plot_url': plot_url, 'aggregation_method': agg_label})
+        plot_groups.append(group_name)
+        plot_args.append((agg_dap['Patient ID'], agg_dap[TARGET_DAP_UNIT_LABEL_DX],
+                          'Patient ID', f'{agg_label} {TARGET_DAP_UNIT_LABEL_DX}', f'{agg_label} DAP', group_name))
         table_detail = group_exams.sort_values(by=['Patient ID', 'study_date'])
         tables.append({'body_part': group_name, 'table': table_detail.to_dict(orient='records')})
-    return render_template('compare_dap.html', plots=plots, tables=tables, 
-                           body_parts_examined=body_parts_for_page, 
-                           selected_body_part=selected_filter, current_modality='DX')
+    for group_name, plot_url in zip(plot_groups, _generate_comparison_plots(plot_args, distributions=True)):
+        if plot_url: plots.append({'body_part': group_name, 'plot_url': plot_url, 'aggregation_method': agg_label})
+    return _render_comparison_page('compare_dap.html', plots=plots, tables=tables, 
+                                   body_parts_examined=body_parts_for_page, 
+                                   selected_body_part=selected_filter, current_modality='DX')
 
 @app.route('/export_excel_dx_dap_filtered')
+@conditional_on_store_version
 def export_excel_dx_dap_filtered():
     if session.get('modality') != 'DX':
         flash("Excel export for DX only.", "error")
@@ -1187,80 +2626,90 @@ def export_excel_dx_dap_filtered():
     if not body_part_filter:
         flash("Select Body Part for export.", "warning")
         return redirect(url_for('compare_dap'))
-    records = []
-    for r_meta in filter(lambda r: r['modality'] == 'DX' and r.get('body_part','').strip().upper() == body_part_filter.upper(), REPORT_INDEX):
-        dap_val_str = r_meta.get(TARGET_DAP_STORAGE_KEY_DX, 'N/A')
-        dap_val_num = None
-        if not str(dap_val_str).lower().startswith('n/a'):
-            try: dap_val_num = float(dap_val_str)
-            except ValueError: pass
-        records.append({
-            'Body Part Examined': r_meta.get('body_part', ''), 'Patient ID': r_meta.get('Patient ID', 'N/A'),
-            'Filename': r_meta.get('filename', ''), 'Modality': r_meta.get('modality', ''),
-            TARGET_DAP_UNIT_LABEL_DX: dap_val_num if dap_val_num is not None else 'N/A',
-            'Study Date': r_meta.get('Study Date', '')
-        })
-    if not records:
+    rows = _export_rows(REPORT_STORE.iter_columns('DX', EXPORT_REPORT_COLUMNS['DX'], body_part=body_part_filter))
+    first_row = next(rows, None)
+    if first_row is None:
         flash(f"No data for export: {body_part_filter}", "info")
         return redirect(url_for('compare_dap'))
-    response = _create_excel_export(pd.DataFrame(records), body_part_filter, "DX_DAP_Export")
+    response = _stream_export(['Body Part Examined', 'Patient ID', 'Filename', 'Modality', TARGET_DAP_UNIT_LABEL_DX, 'Study Date'],
+                              itertools.chain([first_row], rows), body_part_filter, "DX_DAP_Export",
+                              numeric_columns=[TARGET_DAP_UNIT_LABEL_DX])
+    return response if response else redirect(url_for('compare_dap'))
+
+def _mg_organ_dose_frame(mg_df):
+    """MG reports with a numeric organ dose, in the column layout the organ dose comparison works on."""
+    with_dose = mg_df[mg_df['dose'].notna()]
+    return pd.DataFrame({
+        'Patient ID': with_dose['patient_id'],
+        'Study Date': with_dose['study_date'].fillna('N/A'),
+        'Raw Study Date': with_dose['raw_study_date'],
+        TARGET_ORGAN_DOSE_STORAGE_KEY_MG: with_dose['dose'],
+        'Body Part Examined': with_dose['body_part'].astype('object').fillna('N/A'),
+        'View Position': with_dose['view_position'].astype('object').fillna('N/A'),
+        'report_id': with_dose['id']
+    })
+
+@app.route('/export_dx_all_excel')
+@conditional_on_store_version
+def export_dx_all_excel():
+    """Every DX report in one workbook: a sheet per Body Part Examined plus per-body-part DAP totals."""
+    if session.get('modality') != 'DX':
+        flash("Excel export for DX only.", "error")
+        return redirect(url_for('list_reports'))
+    if not REPORT_STORE.count('DX'):
+        flash("No DX reports data to export.", "info")
+        return redirect(url_for('compare_dap'))
+    totals = {}
+    def grouped_rows():
+        for row in _export_rows(REPORT_STORE.iter_columns('DX', EXPORT_REPORT_COLUMNS['DX'], order_by=DX_EXPORT_GROUP_SQL)):
+            group = (row[0] or '').strip().upper() or 'N/A'
+            count, dap_count, dap_sum, dap_min, dap_max = totals.get(group, (0, 0, 0.0, None, None))
+            dap = row[4] if row[4] != 'N/A' else None
+            if dap is not None:
+                dap_count, dap_sum = dap_count + 1, dap_sum + dap
+                dap_min = dap if dap_min is None else min(dap_min, dap)
+                dap_max = dap if dap_max is None else max(dap_max, dap)
+            totals[group] = (count + 1, dap_count, dap_sum, dap_min, dap_max)
+            yield group, row
+    def summary_rows():
+        for group, (count, dap_count, dap_sum, dap_min, dap_max) in totals.items():
+            yield (group, count, dap_count, round(dap_sum / dap_count, 2) if dap_count else 'N/A',
+                   dap_min if dap_min is not None else 'N/A', dap_max if dap_max is not None else 'N/A')
+    response = _send_grouped_xlsx(
+        'DX_DAP_Export_All.xlsx',
+        ['Body Part Examined', 'Patient ID', 'Filename', 'Modality', TARGET_DAP_UNIT_LABEL_DX, 'Study Date'],
+        grouped_rows(),
+        ['Body Part Examined', 'Number of Reports', 'Reports with DAP', f'Mean {TARGET_DAP_UNIT_LABEL_DX}',
+         f'Min {TARGET_DAP_UNIT_LABEL_DX}', f'Max {TARGET_DAP_UNIT_LABEL_DX}'],
+        summary_rows
+    )
     return response if response else redirect(url_for('compare_dap'))
 
 @app.route('/compare_mg_organ_dose')
+@conditional_on_store_version
 def compare_mg_organ_dose():
     if session.get('modality') != 'MG':
         flash("Organ Dose Comparison is for MG modality only.", "warning")
         return redirect(url_for('list_reports'))
 
-    mg_reports = [r for r in REPORT_INDEX if r['modality'] == 'MG']
-    if not mg_reports:
-        flash("No MG reports uploaded to compare Organ Dose.", "info")
-        return render_template('compare_organ_dose_mg.html',
-                               summary_data=[],
-                               plot_url_mg_organ_dose=None,
-                               current_modality='MG',
-                               # เพิ่มตัวแปรสำหรับ filter (ถ้ามี)
-                               body_parts_examined = sorted(list(set(r.get('body_part', 'N/A') for r in mg_reports if r.get('body_part', 'N/A') != 'N/A'))),
-                               view_positions = sorted(list(set(r.get('view_position', 'N/A') for r in mg_reports if r.get('view_position', 'N/A') != 'N/A'))),
-                               selected_body_part_filter = request.args.get('body_part_filter'),
-                               selected_view_position_filter = request.args.get('view_position_filter')
-                               )
-
-    records = []
-    for r_meta in mg_reports:
-        # ใช้ค่าที่เก็บไว้ใน REPORT_INDEX โดยตรง
-        organ_dose_str = r_meta.get(TARGET_ORGAN_DOSE_STORAGE_KEY_MG, 'N/A')
-        organ_dose_val = None
-        if not str(organ_dose_str).lower().startswith('n/a') and "invalid" not in str(organ_dose_str).lower():
-            try:
-                organ_dose_val = float(organ_dose_str)
-            except ValueError:
-                print(f"Could not parse Organ Dose '{organ_dose_str}' for report ID {r_meta['id']} in comparison.")
-        
-        if organ_dose_val is not None:
-            records.append({
-                'Patient ID': r_meta.get('Patient ID', 'N/A'),
-                'Study Date': r_meta.get('Study Date', 'N/A'), # วันที่ที่ format แล้ว
-                'Raw Study Date': r_meta.get('Raw Study Date', ''), # YYYYMMDD สำหรับการ sort ที่แม่นยำ
-                TARGET_ORGAN_DOSE_STORAGE_KEY_MG: organ_dose_val,
-                'Body Part Examined': r_meta.get('body_part', 'N/A'),
-                'View Position': r_meta.get('view_position', 'N/A'),
-                'report_id': r_meta.get('id') # อาจมีประโยชน์สำหรับการ link กลับไปดู report
-            })
-
-    if not records:
-        flash("No MG reports with valid Organ Dose data found for comparison.", "info")
-        return render_template('compare_organ_dose_mg.html',
-                               summary_data=[],
-                               plot_url_mg_organ_dose=None,
-                               current_modality='MG',
-                               body_parts_examined = sorted(list(set(r.get('body_part', 'N/A') for r in mg_reports if r.get('body_part', 'N/A') != 'N/A'))),
-                               view_positions = sorted(list(set(r.get('view_position', 'N/A') for r in mg_reports if r.get('view_position', 'N/A') != 'N/A'))),
-                               selected_body_part_filter = request.args.get('body_part_filter'),
-                               selected_view_position_filter = request.args.get('view_position_filter')
-                               )
-
-    df_all_mg = pd.DataFrame(records)
+    mg_df = REPORT_STORE.frame('MG')
+    df_all_mg = _mg_organ_dose_frame(mg_df)
+    if df_all_mg.empty:
+        if mg_df.empty:
+            flash("No MG reports uploaded to compare Organ Dose.", "info")
+        else:
+            flash("No MG reports with valid Organ Dose data found for comparison.", "info")
+        def known_values(column):
+            return sorted(v for v in mg_df[column].dropna().astype('object').unique() if v != 'N/A')
+        return _render_comparison_page('compare_organ_dose_mg.html',
+                                       summary_data=[],
+                                       plot_url_mg_organ_dose=None,
+                                       current_modality='MG',
+                                       body_parts_examined = known_values('body_part'),
+                                       view_positions = known_values('view_position'),
+                                       selected_body_part_filter = request.args.get('body_part_filter'),
+                                       selected_view_position_filter = request.args.get('view_position_filter')
+                                       )
 
     # --- Apply Filters ---
     body_part_filter = request.args.get('body_part_filter')
@@ -1279,15 +2728,15 @@ def compare_mg_organ_dose():
     if filtered_df.empty:
         flash(f"No MG data found matching the filter criteria: {', '.join(filter_active_message) if filter_active_message else 'None'}.", "info")
         # ยังคงส่งค่า filter ที่เลือกไปให้ template
-        return render_template('compare_organ_dose_mg.html',
-                               summary_data=[],
-                               plot_url_mg_organ_dose=None,
-                               current_modality='MG',
-                               body_parts_examined = sorted(list(set(df_all_mg['Body Part Examined'].unique()))),
-                               view_positions = sorted(list(set(df_all_mg['View Position'].unique()))),
-                               selected_body_part_filter = body_part_filter,
-                               selected_view_position_filter = view_position_filter
-                               )
+        return _render_comparison_page('compare_organ_dose_mg.html',
+                                       summary_data=[],
+                                       plot_url_mg_organ_dose=None,
+                                       current_modality='MG',
+                                       body_parts_examined = sorted(list(set(df_all_mg['Body Part Examined'].unique()))),
+                                       view_positions = sorted(list(set(df_all_mg['View Position'].unique()))),
+                                       selected_body_part_filter = body_part_filter,
+                                       selected_view_position_filter = view_position_filter
+                                       )
 
 
     # Group by Patient ID and Study Date, then calculate mean and count
@@ -1332,7 +2781,8 @@ def compare_mg_organ_dose():
                 x_label='Patient (Study Date)',
                 y_label=f'Average {TARGET_ORGAN_DOSE_UNIT_LABEL_MG}',
                 title_prefix=f'Average Organ Dose (MG) - {plot_title_suffix}',
-                group_name="PatientAverages" # Generic group name for the plot file
+                group_name="PatientAverages", # Generic group name for the plot file
+                distribution=True
             )
         elif len(patient_daily_avg_dose) == 1:
              flash("Only one data point after aggregation; plot not generated.", "info")
@@ -1343,57 +2793,37 @@ def compare_mg_organ_dose():
     all_view_positions = sorted(list(set(df_all_mg['View Position'].unique())))
 
 
-    return render_template('compare_organ_dose_mg.html',
-                           summary_data=summary_list_for_template,
-                           plot_url_mg_organ_dose=plot_url_mg_organ_dose,
-                           current_modality='MG',
-                           TARGET_ORGAN_DOSE_UNIT_LABEL_MG=TARGET_ORGAN_DOSE_UNIT_LABEL_MG,
-                           body_parts_examined=all_body_parts, # Pass all available for dropdown
-                           view_positions=all_view_positions, # Pass all available for dropdown
-                           selected_body_part_filter=body_part_filter,
-                           selected_view_position_filter=view_position_filter,
-                           filter_active_message = ", ".join(filter_active_message) if filter_active_message else None
-                           )
+    return _render_comparison_page('compare_organ_dose_mg.html',
+                                   summary_data=summary_list_for_template,
+                                   plot_url_mg_organ_dose=plot_url_mg_organ_dose,
+                                   current_modality='MG',
+                                   TARGET_ORGAN_DOSE_UNIT_LABEL_MG=TARGET_ORGAN_DOSE_UNIT_LABEL_MG,
+                                   body_parts_examined=all_body_parts, # Pass all available for dropdown
+                                   view_positions=all_view_positions, # Pass all available for dropdown
+                                   selected_body_part_filter=body_part_filter,
+                                   selected_view_position_filter=view_position_filter,
+                                   filter_active_message = ", ".join(filter_active_message) if filter_active_message else None
+                                   )
 
 
 @app.route('/export_excel_mg_organ_dose_avg')
+@conditional_on_store_version
 def export_excel_mg_organ_dose_avg():
     if session.get('modality') != 'MG':
         flash("Excel export for Average MG Organ Dose is for MG modality only.", "error")
         return redirect(url_for('list_reports'))
 
-    # Re-fetch and process data similar to the compare_mg_organ_dose route
-    mg_reports = [r for r in REPORT_INDEX if r['modality'] == 'MG']
-    if not mg_reports:
+    # Same typed data as the compare_mg_organ_dose route
+    mg_df = REPORT_STORE.frame('MG')
+    if mg_df.empty:
         flash("No MG reports data to export.", "info")
         return redirect(url_for('compare_mg_organ_dose'))
 
-    records = []
-    for r_meta in mg_reports:
-        organ_dose_str = r_meta.get(TARGET_ORGAN_DOSE_STORAGE_KEY_MG, 'N/A')
-        organ_dose_val = None
-        if not str(organ_dose_str).lower().startswith('n/a') and "invalid" not in str(organ_dose_str).lower():
-            try:
-                organ_dose_val = float(organ_dose_str)
-            except ValueError:
-                pass # Skip if parsing fails
-        
-        if organ_dose_val is not None:
-            records.append({
-                'Patient ID': r_meta.get('Patient ID', 'N/A'),
-                'Study Date': r_meta.get('Study Date', 'N/A'),
-                TARGET_ORGAN_DOSE_STORAGE_KEY_MG: organ_dose_val,
-                'Body Part Examined': r_meta.get('body_part', 'N/A'),
-                'View Position': r_meta.get('view_position', 'N/A'),
-                'Report ID': r_meta.get('id')
-            })
-    
-    if not records:
+    df_all_mg_export = _mg_organ_dose_frame(mg_df).rename(columns={'report_id': 'Report ID'})
+    if df_all_mg_export.empty:
         flash("No valid MG Organ Dose data to export.", "info")
         return redirect(url_for('compare_mg_organ_dose'))
 
-    df_all_mg_export = pd.DataFrame(records)
-
     # Apply filters if they are passed as query parameters
     body_part_filter = request.args.get('body_part_filter')
     view_position_filter = request.args.get('view_position_filter')
@@ -1457,18 +2887,12 @@ def search_patient():
     if request.method == 'POST':
         patient_id_search = request.form.get('patient_id', '').strip()
         if patient_id_search:
-            for r_meta in filter(lambda r: r.get('Patient ID','').strip() == patient_id_search and r['modality'] == current_modality, REPORT_INDEX):
+            for r_meta in REPORT_STORE.reports(current_modality, patient_id=patient_id_search):
                 entry = {'report_id': r_meta['id'], 'study_date': r_meta.get('Study Date', 'N/A'), 'filename': r_meta['filename']}
                 if current_modality == 'CT':
                     entry['study_description'] = r_meta.get('study_description', 'N/A')
                     entry['total_dlp'] = 'N/A' 
-                    try: 
-                        dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], r_meta['save_name'])
-                        if os.path.exists(dicom_path):
-                            ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-                            _, _, total_dlp_val = extract_ct_dose_info(ds)
-                            if total_dlp_val is not None: entry['total_dlp'] = total_dlp_val
-                    except Exception as e: print(f"Error getting TotalDLP for search: {e}")
+                    if r_meta.get('total_dlp') is not None: entry['total_dlp'] = r_meta['total_dlp']
                 elif current_modality == 'DX':
                     entry['body_part'] = r_meta.get('body_part', 'N/A')
                     entry['dap_value_label'] = TARGET_DAP_UNIT_LABEL_DX 
@@ -1484,47 +2908,37 @@ def search_patient():
                            patient_id=patient_id_search, current_modality=current_modality)
 
 @app.route('/compare_patient/<patient_id>')
+@conditional_on_store_version
 def compare_patient(patient_id):
     current_modality = session.get('modality')
     if not current_modality:
         flash("Select modality first.", "error")
         return redirect(url_for('select_modality'))
     patient_id_stripped = patient_id.strip()
-    reports_for_patient = [r for r in REPORT_INDEX if r.get('Patient ID','').strip() == patient_id_stripped and r['modality'] == current_modality]
-    if not reports_for_patient:
+    reports_for_patient = REPORT_STORE.frame(current_modality, patient_id=patient_id_stripped)
+    if reports_for_patient.empty:
         flash(f"No {current_modality} reports for Patient ID '{patient_id_stripped}'.", "info")
-        return render_template('compare_patient.html', patient_id=patient_id_stripped, studies=[], current_modality=current_modality)
+        return _render_comparison_page('compare_patient.html', patient_id=patient_id_stripped, studies=[], current_modality=current_modality)
     studies_data, plot_url, value_axis_label = [], None, ""
-    for r_meta in reports_for_patient:
-        entry = {'report_id': r_meta['id'], 'study_date': r_meta.get('Study Date','N/A'), 'filename': r_meta['filename']}
-        numeric_val = None
+    doses = reports_for_patient['dose'].astype('object').where(reports_for_patient['dose'].notna(), None)
+    study_dates = reports_for_patient['study_date'].fillna('N/A')
+    for report_id, study_date, filename, study_description, body_part, numeric_val in zip(
+            reports_for_patient['id'], study_dates, reports_for_patient['filename'],
+            reports_for_patient['study_description'].astype('object'),
+            reports_for_patient['body_part'].astype('object'), doses):
+        entry = {'report_id': report_id, 'study_date': study_date, 'filename': filename}
         if current_modality == 'CT':
-            entry['study_description'] = r_meta.get('study_description', 'N/A')
+            entry['study_description'] = study_description if study_description is not None else 'N/A'
             value_axis_label = 'Total DLP (mGy·cm)'
             entry['group_label'] = f"{entry['study_description'] or 'N/A'} ({entry['study_date']})"
-            try: 
-                dicom_path = os.path.join(app.config['UPLOAD_FOLDER'], r_meta['save_name'])
-                if os.path.exists(dicom_path):
-                    ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
-                    _, _, total_dlp_val = extract_ct_dose_info(ds)
-                    if total_dlp_val is not None: numeric_val = total_dlp_val
-            except Exception as e: print(f"Error for patient DLP plot: {e}")
         elif current_modality == 'DX':
-            entry['body_part'] = r_meta.get('body_part', 'N/A')
+            entry['body_part'] = body_part if body_part is not None else 'N/A'
             value_axis_label = TARGET_DAP_UNIT_LABEL_DX
             entry['group_label'] = f"{entry['body_part'] or 'N/A'} ({entry['study_date']})"
-            dap_str = r_meta.get(TARGET_DAP_STORAGE_KEY_DX, 'N/A')
-            if not str(dap_str).lower().startswith('n/a') and "invalid" not in str(dap_str).lower():
-                try: numeric_val = float(dap_str)
-                except ValueError: pass
         elif current_modality == 'MG':
-            entry['study_description'] = r_meta.get('study_description', 'N/A') 
+            entry['study_description'] = study_description if study_description is not None else 'N/A'
             value_axis_label = TARGET_ORGAN_DOSE_UNIT_LABEL_MG
             entry['group_label'] = f"{entry.get('study_description', 'N/A')} ({entry['study_date']})"
-            organ_dose_str = r_meta.get(TARGET_ORGAN_DOSE_STORAGE_KEY_MG, 'N/A')
-            if not str(organ_dose_str).lower().startswith('n/a') and "invalid" not in str(organ_dose_str).lower():
-                try: numeric_val = float(organ_dose_str)
-                except ValueError: pass
         entry['value'] = numeric_val
         studies_data.append(entry) 
     plot_data_points = [s for s in studies_data if s.get('value') is not None]
@@ -1536,9 +2950,83 @@ def compare_patient(patient_id):
         if not plot_url: flash("Error generating patient comparison plot.", "error")
     else:
         flash(f"No numeric data to plot for Patient '{patient_id_stripped}'.", "warning")
-    return render_template('compare_patient.html', patient_id=patient_id_stripped, plot_url=plot_url, 
-                           studies=studies_data, current_modality=current_modality, 
-                           value_label=value_axis_label or "Dose Value")
+    return _render_comparison_page('compare_patient.html', patient_id=patient_id_stripped, plot_url=plot_url, 
+                                   studies=studies_data, current_modality=current_modality, 
+                                   value_label=value_axis_label or "Dose Value")
+
+# ==============================================================================
+# ==== COMMAND LINE ====
+# ==============================================================================
+
+IMPORT_BATCH_SIZE = 500
+
+def _link_or_copy(source_path, destination_path):
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copy2(source_path, destination_path)
+
+@app.cli.command('import-dicom')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--modality', type=click.Choice(MODALITIES), default=None,
+              help='Only import reports of this modality (default: all supported modalities).')
+def import_dicom_command(directory, modality):
+    """Index every .dcm file under DIRECTORY, skipping files that are already indexed."""
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names if allowed_file(name)
+    )
+    click.echo(f"Found {len(paths)} .dcm file(s) under {directory}.")
+    imported = skipped = failed = 0
+    start = time.perf_counter()
+    for batch_start in range(0, len(paths), IMPORT_BATCH_SIZE):
+        fingerprints = list(_map_on_ingest_pool(fingerprint_dose_file, paths[batch_start:batch_start + IMPORT_BATCH_SIZE],
+                                                 fingerprint_crashed))
+        known_hashes, known_sop_uids = REPORT_STORE.known_fingerprints(
+            [fp[1] for fp in fingerprints], [fp[2] for fp in fingerprints]
+        )
+        ingest_tasks = []
+        for path, content_hash, sop_instance_uid, file_modality, error in fingerprints:
+            if error:
+                failed += 1
+                click.echo(error, err=True)
+                continue
+            if file_modality not in MODALITIES or (modality and file_modality != modality):
+                skipped += 1
+                continue
+            if content_hash in known_hashes or (sop_instance_uid and sop_instance_uid in known_sop_uids):
+                skipped += 1
+                continue
+            known_hashes.add(content_hash)
+            if sop_instance_uid: known_sop_uids.add(sop_instance_uid)
+            original_filename = secure_filename(os.path.basename(path))
+            unique_suffix = uuid.uuid4().hex[:8]
+            save_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{unique_suffix}_{original_filename}")
+            try:
+                _link_or_copy(path, save_path)
+            except OSError as e:
+                failed += 1
+                click.echo(f"Error copying '{path}': {type(e).__name__} - {str(e)}", err=True)
+                continue
+            ingest_tasks.append((save_path, original_filename, unique_suffix, file_modality, content_hash))
+        for report_data, error in ingest_dose_files(ingest_tasks):
+            if error:
+                failed += 1
+                click.echo(error, err=True)
+                continue
+            if REPORT_STORE.add(report_data, skip_duplicates=True) is None:
+                skipped += 1
+                remove_report_file(report_data)
+                continue
+            imported += 1
+        done = min(batch_start + IMPORT_BATCH_SIZE, len(paths))
+        elapsed = time.perf_counter() - start
+        click.echo(f"{done}/{len(paths)} files checked, {done / elapsed:.1f} files/s "
+                   f"({imported} imported, {skipped} skipped, {failed} failed)")
+    elapsed = time.perf_counter() - start
+    click.echo(f"Done in {elapsed:.1f}s: {imported} imported, {skipped} skipped, {failed} failed"
+               f" ({len(paths) / elapsed if elapsed > 0 else 0:.1f} files/s).")
 
 # ==============================================================================
 # ==== MAIN EXECUTION ====
@@ -0,0 +1,57 @@
+"""Benchmark: charting a large group as a bar per patient vs. as a binned histogram.
+
+Renders one group of --patients Total DLP values with render_bar_chart, once with a bar per patient as
+_generate_comparison_plots did for every group, and once through binned_chart_args with at most
+--max-bars bins, as it does now for groups over CHART_MAX_BARS. Reports render time and PNG size.
+
+    python benchmarks/bench_chart_binning.py --patients 600 --max-bars 60
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import binned_chart_args, render_bar_chart  # noqa: E402
+
+
+def best_render(spec, repeat):
+    best, png = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        png = render_bar_chart(*spec)
+        best = min(best, time.perf_counter() - start)
+    return best, png
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=600,
+                        help='values in the group (a bar per patient gets very wide; keep it in the low thousands)')
+    parser.add_argument('--max-bars', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    patient_ids = [f'PAT{i:06d}' for i in range(args.patients)]
+    dlps = [rng.lognormvariate(6.3, 0.5) for _ in patient_ids]
+    title = 'Total DLP for CT CHEST'
+    per_patient = (patient_ids, dlps, 'Patient ID', 'Total DLP (mGy·cm)', title)
+
+    start = time.perf_counter()
+    binned = binned_chart_args(dlps, 'Patient ID', 'Total DLP (mGy·cm)', title, args.max_bars)
+    binning = time.perf_counter() - start
+
+    per_patient_time, per_patient_png = best_render(per_patient, args.repeat)
+    binned_time, binned_png = best_render(binned, args.repeat)
+    print(f'{"bar per patient":>16}: {len(patient_ids):6d} bars  {per_patient_time * 1000:8.1f} ms  '
+          f'{len(per_patient_png) / 1024:8.1f} KiB')
+    print(f'{"binned":>16}: {len(binned[0]):6d} bars  {(binned_time + binning) * 1000:8.1f} ms  '
+          f'{len(binned_png) / 1024:8.1f} KiB  (binning {binning * 1000:.2f} ms)')
+    print(f'speed-up: {per_patient_time / (binned_time + binning):.1f}x, '
+          f'PNG {len(per_patient_png) / len(binned_png):.1f}x smaller')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Benchmark: CT scan event extraction, per-item pydicom attribute access vs. the CTEventTable reader.
+
+Builds one CT dose report with many ExposureDoseSequence events, then times extracting the events
+from a freshly read file (how uploads and the report page see it), reported per 1,000 events. The
+baseline is the per-item extraction extract_ct_dose_info used before CTEventTable.
+
+    python benchmarks/bench_ct_events.py --events 1000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import pydicom
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import CTEventTable, get_clean_value, parse_ct_dose_comments  # noqa: E402
+
+
+def make_report(events, undefined_length):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.88.67'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'CT'
+    ds.PatientID = 'PAT00001'
+    items, comments = [], []
+    for event in range(1, events + 1):
+        item = Dataset()
+        item.AcquisitionType = ('CONSTANT_ANGLE', 'SPIRAL', 'SEQUENCED')[event % 3]
+        item.CTDIvol = 5.0 + event % 11
+        item.KVP = (80, 100, 120)[event % 3]
+        item.XRayTubeCurrentInuA = 250000 + event
+        item.ExposureTime = 800
+        item.SpiralPitchFactor = 0.9
+        phantom = Dataset()
+        phantom.CodeValue = ('113690', '113691')[event % 2]
+        phantom.CodeMeaning = ('IEC Head Dosimetry Phantom', 'IEC Body Dosimetry Phantom')[event % 2]
+        item.CTDIPhantomTypeCodeSequence = Sequence([phantom])
+        items.append(item)
+        comments.append(f'Event={event} DLP={100 + event % 50:.2f}')
+    ds.ExposureDoseSequence = Sequence(items)
+    ds.CommentsOnRadiationDose = 'TotalDLP=836.00 ' + ' '.join(comments)
+    if undefined_length:
+        for elem in ds.iterall():
+            if elem.VR == 'SQ':
+                elem.is_undefined_length = True
+                for sq_item in elem.value:
+                    sq_item.is_undefined_length_sequence_item = True
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def per_item_events(ds, dlp_dict):
+    """The event loop extract_ct_dose_info ran before CTEventTable: display rows built attribute by attribute."""
+    results = []
+    if hasattr(ds, 'ExposureDoseSequence') and ds.ExposureDoseSequence:
+        for idx, item in enumerate(ds.ExposureDoseSequence, 1):
+            acq_type_val = getattr(item, 'AcquisitionType', None)
+            ctdi_vol_val = getattr(item, 'CTDIvol', None)
+            phantom = get_clean_value(item.CTDIPhantomTypeCodeSequence[0], 'CodeMeaning', '') \
+                if hasattr(item, 'CTDIPhantomTypeCodeSequence') and item.CTDIPhantomTypeCodeSequence \
+                else 'N/A'
+            if hasattr(item, 'CTDIPhantomTypeCodeSequence') and item.CTDIPhantomTypeCodeSequence:
+                code_val = get_clean_value(item.CTDIPhantomTypeCodeSequence[0], 'CodeValue', '')
+                if code_val in ['113690', '113701']: phantom = 'Head 16cm'
+                elif code_val in ['113691', '113702']: phantom = 'Body 32cm'
+            scan_type_str = 'N/A'
+            if acq_type_val:
+                acq_type_upper = str(acq_type_val).upper()
+                if acq_type_upper == 'SEQUENCED': scan_type_str = 'Axial'
+                elif acq_type_upper == 'CONSTANT_ANGLE': scan_type_str = 'Scout/Localizer'
+                elif acq_type_upper == 'SPIRAL': scan_type_str = 'Helical'
+                else: scan_type_str = str(acq_type_val)
+            ctdi_display = ''
+            if ctdi_vol_val is not None:
+                try: ctdi_display = round(float(ctdi_vol_val), 2)
+                except (ValueError, TypeError): ctdi_display = str(ctdi_vol_val)
+            dlp_for_event = dlp_dict.get(idx, None)
+            dlp_display = ''
+            if dlp_for_event is not None:
+                try: dlp_display = round(float(dlp_for_event), 2)
+                except (ValueError, TypeError): dlp_display = str(dlp_for_event)
+            kvp_val = getattr(item, 'KVP', None)
+            kvp_display = ''
+            if kvp_val is not None:
+                try: kvp_display = int(round(float(kvp_val)))
+                except (ValueError, TypeError): kvp_display = str(kvp_val)
+            tube_current_in_ua_val = getattr(item, 'XRayTubeCurrentInuA', None)
+            tube_current_display_ma = ''
+            if tube_current_in_ua_val is not None:
+                try: tube_current_display_ma = int(round(float(tube_current_in_ua_val) / 1000.0))
+                except (ValueError, TypeError): tube_current_display_ma = str(tube_current_in_ua_val)
+            exposure_time_val = getattr(item, 'ExposureTime', None)
+            exposure_time_display = ''
+            if exposure_time_val is not None:
+                try: exposure_time_display = int(round(float(exposure_time_val)))
+                except (ValueError, TypeError): exposure_time_display = str(exposure_time_val)
+            pitch_factor_val = getattr(item, 'SpiralPitchFactor', None)
+            pitch_factor_display = ''
+            if pitch_factor_val is not None and scan_type_str == 'Helical':
+                try: pitch_factor_display = round(float(pitch_factor_val), 3)
+                except (ValueError, TypeError): pitch_factor_display = str(pitch_factor_val)
+            elif scan_type_str != 'Helical':
+                pitch_factor_display = 'N/A'
+            results.append({
+                'Series': idx, 'Type': scan_type_str,
+                'CTDIvol': ctdi_display if scan_type_str != 'Scout/Localizer' else '',
+                'DLP': dlp_display if scan_type_str != 'Scout/Localizer' else '',
+                'Phantom': phantom, 'KVP': kvp_display, 'XRayTubeCurrent': tube_current_display_ma,
+                'ExposureTime': exposure_time_display, 'SpiralPitchFactor': pitch_factor_display
+            })
+    return results
+
+
+def time_extractor(extract, raw, dlp_dict, repeat):
+    """Best time of `extract` over `repeat` fresh reads (the dataset read itself is not timed)."""
+    best = float('inf')
+    for _ in range(repeat):
+        ds = pydicom.dcmread(io.BytesIO(raw))
+        start = time.perf_counter()
+        extract(ds, dlp_dict)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--defined-length', action='store_true',
+                        help='write sequences with explicit lengths instead of undefined length')
+    args = parser.parse_args()
+
+    raw = make_report(args.events, not args.defined_length)
+    ds = pydicom.dcmread(io.BytesIO(raw))
+    dlp_dict, _ = parse_ct_dose_comments(ds.CommentsOnRadiationDose)
+    baseline = per_item_events(ds, dlp_dict)
+    assert CTEventTable.from_dataset(pydicom.dcmread(io.BytesIO(raw)), dlp_dict).rows() == baseline, \
+        'CTEventTable rows differ from the per-item extraction'
+    print(f'Report: {args.events} events, {len(raw) / 1e3:.0f} kB')
+
+    scale = 1000 / args.events
+    per_item = time_extractor(per_item_events, raw, dlp_dict, args.repeat)
+    table = time_extractor(CTEventTable.from_dataset, raw, dlp_dict, args.repeat)
+    table_obj = CTEventTable.from_dataset(pydicom.dcmread(io.BytesIO(raw)), dlp_dict)
+    record = table_obj.to_record()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        CTEventTable.from_record(record).rows()
+    render = (time.perf_counter() - start) / args.repeat
+    print(f'{"per-item rows":>22}: {per_item * scale * 1000:8.2f} ms per 1,000 events')
+    print(f'{"CTEventTable":>22}: {table * scale * 1000:8.2f} ms per 1,000 events')
+    print(f'{"rows() from record":>22}: {render * scale * 1000:8.2f} ms per 1,000 events (report page)')
+    print(f'Speed-up: {per_item / table:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
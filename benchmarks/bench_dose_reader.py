@@ -0,0 +1,175 @@
+"""Benchmark: full-header dcmread vs. the selective-tag read_dose_dataset used at ingestion.
+
+Builds a synthetic corpus of CT/DX/MG dose reports padded with the kind of content real
+RDSRs carry but the extractors never look at (large private groups, a nested SR
+ContentSequence), then times both readers and measures their peak allocation.
+
+    python benchmarks/bench_dose_reader.py --files 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pydicom
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import read_dose_dataset, extract_ct_dose_info, extract_dx_dose_info, extract_mg_dose_info  # noqa: E402
+
+
+def extract_ct(ds):
+    info, events, total_dlp = extract_ct_dose_info(ds)
+    return info, events.rows(), total_dlp
+
+
+EXTRACTORS = {
+    'CT': extract_ct,
+    'DX': extract_dx_dose_info,
+    'MG': extract_mg_dose_info,
+}
+
+
+def _content_tree(depth, width):
+    items = []
+    for i in range(width):
+        item = Dataset()
+        item.ValueType = 'TEXT' if depth == 0 else 'CONTAINER'
+        item.TextValue = f'Synthetic SR content item {depth}.{i}' * 4
+        if depth > 0:
+            item.ContentSequence = _content_tree(depth - 1, width)
+        items.append(item)
+    return Sequence(items)
+
+
+def make_report(modality, index, private_elements, private_size, sr_depth, sr_width, undefined_length):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.88.67'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = modality
+    ds.PatientID = f'PAT{index:05d}'
+    ds.PatientAge = '054Y'
+    ds.StudyDate = '20240115'
+    ds.StudyDescription = ['CHEST', 'ABDOMEN', 'HEAD'][index % 3]
+    ds.SeriesDescription = 'Dose Report'
+    ds.Manufacturer = 'SYNTHETIC'
+    if modality == 'CT':
+        events, comments = [], []
+        for event in range(1, 9):
+            item = Dataset()
+            item.AcquisitionType = 'CONSTANT_ANGLE' if event == 1 else 'SPIRAL'
+            item.CTDIvol = 5.0 + event
+            item.KVP = 120
+            item.XRayTubeCurrentInuA = 250000
+            item.ExposureTime = 800
+            item.SpiralPitchFactor = 0.9
+            phantom = Dataset()
+            phantom.CodeValue = '113691'
+            phantom.CodeMeaning = 'IEC Body Dosimetry Phantom'
+            item.CTDIPhantomTypeCodeSequence = Sequence([phantom])
+            events.append(item)
+            comments.append(f'Event={event} DLP={100 + event:.2f}')
+        ds.ExposureDoseSequence = Sequence(events)
+        ds.CommentsOnRadiationDose = 'TotalDLP=836.00 ' + ' '.join(comments)
+    else:
+        ds.BodyPartExamined = 'CHEST' if modality == 'DX' else 'BREAST'
+        ds.ViewPosition = 'PA' if modality == 'DX' else 'CC'
+        ds.KVP = 110 if modality == 'DX' else 28
+        ds.Exposure = 4
+        ds.DistanceSourceToDetector = 1800
+        ds.ImageAndFluoroscopyAreaDoseProduct = 0.15
+        ds.EntranceDoseInmGy = 0.4
+        ds.OrganDose = 0.015
+        ds.OrganExposed = 'BREAST'
+    ds.ContentSequence = _content_tree(sr_depth, sr_width)
+    block = ds.private_block(0x0029, 'SYNTHETIC VENDOR', create=True)
+    for offset in range(private_elements):
+        block.add_new(offset, 'OB', os.urandom(private_size))
+    if undefined_length:
+        # Most modalities write sequences and items with undefined length, which a reader
+        # cannot seek over and has to parse element by element.
+        for elem in ds.iterall():
+            if elem.VR == 'SQ':
+                elem.is_undefined_length = True
+                for item in elem.value:
+                    item.is_undefined_length_sequence_item = True
+    return ds
+
+
+def build_corpus(folder, count, args):
+    paths = []
+    for index in range(count):
+        modality = ('CT', 'DX', 'MG')[index % 3]
+        ds = make_report(modality, index, args.private_elements, args.private_size, args.sr_depth, args.sr_width,
+                         not args.defined_length)
+        path = os.path.join(folder, f'{modality}_{index:05d}.dcm')
+        ds.save_as(path, enforce_file_format=True)
+        paths.append((modality, path))
+    return paths
+
+
+def full_read(path, modality):
+    return pydicom.dcmread(path, stop_before_pixels=True)
+
+
+def time_reader(reader, corpus):
+    start = time.perf_counter()
+    for modality, path in corpus:
+        EXTRACTORS[modality](reader(path, modality))
+    return time.perf_counter() - start
+
+
+def peak_memory(reader, corpus):
+    """Largest allocation peak of reading + extracting a single file (tracemalloc is too slow to time with)."""
+    tracemalloc.start()
+    peak = 0
+    for modality, path in corpus:
+        tracemalloc.reset_peak()
+        EXTRACTORS[modality](reader(path, modality))
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=150)
+    parser.add_argument('--private-elements', type=int, default=40)
+    parser.add_argument('--private-size', type=int, default=4096)
+    parser.add_argument('--sr-depth', type=int, default=3)
+    parser.add_argument('--sr-width', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--defined-length', action='store_true',
+                        help='write sequences with explicit lengths instead of undefined length')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        corpus = build_corpus(folder, args.files, args)
+        size_mb = sum(os.path.getsize(p) for _, p in corpus) / 1e6
+        print(f'Corpus: {len(corpus)} files, {size_mb:.1f} MB')
+
+        for modality, path in corpus[:3]:
+            full = EXTRACTORS[modality](full_read(path, modality))
+            selective = EXTRACTORS[modality](read_dose_dataset(path, modality))
+            assert full == selective, f'{modality}: selective read changed the extracted values'
+
+        results = {}
+        for name, reader in (('full header', full_read), ('selective tags', read_dose_dataset)):
+            elapsed = min(time_reader(reader, corpus) for _ in range(args.repeat))
+            peak = peak_memory(reader, corpus)
+            results[name] = (elapsed, peak)
+            print(f'{name:>15}: {elapsed / len(corpus) * 1000:7.3f} ms/file  '
+                  f'{len(corpus) / elapsed:8.1f} files/s  peak {peak / 1024:8.1f} KiB')
+        (full_t, full_m), (sel_t, sel_m) = results['full header'], results['selective tags']
+        print(f'Speed-up: {full_t / sel_t:.2f}x, peak memory: {sel_m / full_m:.0%} of full read')
+
+
+if __name__ == '__main__':
+    main()
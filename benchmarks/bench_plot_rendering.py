@@ -0,0 +1,85 @@
+"""Benchmark: comparison chart rendering, pyplot per chart vs. the Figure/Agg renderer, serial and parallel.
+
+Renders one page worth of comparison charts (one per group, with a bar per patient) three ways:
+through pyplot's global state as _generate_comparison_plot used to, with render_bar_chart on a
+reused Figure, and with render_bar_charts on the plot worker processes. Reports charts per second.
+
+    python benchmarks/bench_plot_rendering.py --charts 24 --bars 30 --workers 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+from app import render_bar_chart, render_bar_charts  # noqa: E402
+import matplotlib.pyplot as plt  # noqa: E402
+
+
+def pyplot_chart(x_data, y_data, x_label, y_label, title):
+    """The pyplot rendering _generate_comparison_plot did before render_bar_chart."""
+    plt.figure(figsize=(max(8, len(x_data) * 0.5 + 2), 6.5))
+    plt.bar(x_data, y_data, color='#5eaaa8', width=0.6)
+    plt.xlabel(x_label, fontsize=12)
+    plt.ylabel(y_label, fontsize=12)
+    plt.title(title, fontsize=14, fontweight='bold')
+    plt.xticks(rotation=45, ha="right", fontsize=10)
+    plt.yticks(fontsize=10)
+    plt.grid(axis='y', linestyle=':', alpha=0.7)
+    plt.tight_layout(pad=1.5)
+    buffer = BytesIO()
+    plt.savefig(buffer, format='png')
+    plt.close()
+    return buffer.getvalue()
+
+
+def make_specs(charts, bars, seed=0):
+    rng = random.Random(seed)
+    return [([f'PAT{chart:03d}{bar:04d}' for bar in range(rng.randint(max(1, bars // 2), bars))],
+             [rng.uniform(50, 1500) for _ in range(bars)], 'Patient ID', 'Total DLP (mGy·cm)',
+             f'Total DLP for STUDY {chart}')
+            for chart in range(charts)]
+
+
+def time_pages(render_page, specs, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_page(specs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--charts', type=int, default=24, help='charts (groups) on the page')
+    parser.add_argument('--bars', type=int, default=30, help='most bars (patients) per chart')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    specs = [(x, y[:len(x)], *rest) for x, y, *rest in make_specs(args.charts, args.bars)]
+    app.app.config['PLOT_WORKERS'] = args.workers
+    render_bar_charts(specs[:2])  # start the worker processes outside the timing
+
+    runs = (
+        ('pyplot', lambda page: [pyplot_chart(*spec) for spec in page]),
+        ('Figure/Agg', lambda page: [render_bar_chart(*spec) for spec in page]),
+        (f'Figure/Agg x{args.workers} proc', render_bar_charts),
+    )
+    results = {}
+    for name, render_page in runs:
+        elapsed = time_pages(render_page, specs, args.repeat)
+        results[name] = elapsed
+        print(f'{name:>22}: {len(specs) / elapsed:7.1f} charts/s  ({elapsed * 1000:7.1f} ms per page of {len(specs)})')
+    baseline = results['pyplot']
+    for name, elapsed in results.items():
+        if name != 'pyplot':
+            print(f'{name} speed-up over pyplot: {baseline / elapsed:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark: report list pages from the cached sorted view, before and after other uploads change the store.
+
+Fills a report store with --reports DX reports (or reuses --db), then times a /reports page — the sorted view,
+the page's records and the filter lists — cold, warm, and right after a CT upload, a DX upload and a DX delete.
+Each changed view is checked against one rebuilt from scratch.
+
+    python benchmarks/bench_report_list.py --reports 100000 --db /tmp/reports.sqlite3
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import PER_PAGE, TARGET_DAP_STORAGE_KEY_DX, ReportStore  # noqa: E402
+
+BODY_PARTS = ('CHEST', 'Chest', 'HAND', 'Knee', 'FOOT', 'N/A', 'PELVIS', 'skull', None)
+
+
+def make_report(rng, modality, index):
+    return {
+        'id': uuid.uuid4().hex, 'modality': modality, 'filename': f'report_{index}.dcm', 'save_name': f'{index}.dcm',
+        'Patient ID': f'PAT{rng.randrange(20000):05d}', 'study_description': '',
+        'Raw Study Date': f'2024{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}',
+        'body_part': rng.choice(BODY_PARTS), 'view_position': rng.choice(('AP', 'PA', 'LAT')),
+        TARGET_DAP_STORAGE_KEY_DX: rng.choice((None, rng.uniform(0, 5))), 'content_hash': uuid.uuid4().hex,
+    }
+
+
+def list_page(store, sort_column, page):
+    """What list_reports reads for one DX page."""
+    view = store.sorted_view('DX', sort_column)
+    store.by_seq(view.page(page * PER_PAGE, PER_PAGE, descending=True))
+    store.distinct_values('DX', 'body_part')
+    return view
+
+
+def timed(store, sort_column, page):
+    start = time.perf_counter()
+    view = list_page(store, sort_column, page)
+    return (time.perf_counter() - start) * 1000, view
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reports', type=int, default=20000, help='DX reports to store (about 0.6 ms each)')
+    parser.add_argument('--db', help='report store to fill or reuse (default: a temporary file)')
+    parser.add_argument('--sort-column', default='body_part')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    store = ReportStore(args.db or os.path.join(tempfile.mkdtemp(), 'reports.sqlite3'))
+    rng = random.Random(0)
+    stored = store.count('DX')
+    if stored < args.reports:
+        start = time.perf_counter()
+        for index in range(stored, args.reports):
+            store.add(make_report(rng, 'DX', index))
+        print(f'Stored {args.reports - stored} reports in {time.perf_counter() - start:.1f} s')
+    store = ReportStore(store.db_path)
+    print(f'Store: {store.count("DX")} DX reports, page {PER_PAGE} rows, sorted by {args.sort_column}')
+
+    page = 3
+    cold, _ = timed(store, args.sort_column, page)
+    warm = min(timed(store, args.sort_column, page)[0] for _ in range(args.repeat))
+    print(f'{"cold (build)":>22}: {cold:8.2f} ms')
+    print(f'{"warm":>22}: {warm:8.2f} ms')
+    changes = (
+        ('after a CT upload', lambda: store.add(make_report(rng, 'CT', 0))),
+        ('after a DX upload', lambda: store.add(make_report(rng, 'DX', 0))),
+        ('after a DX delete', lambda: store.delete(store.by_seq(store.sorted_view('DX', 'seq').page(0, 1))[0]['id'])),
+    )
+    for label, change in changes:
+        times = []
+        for _ in range(args.repeat):
+            change()
+            elapsed, view = timed(store, args.sort_column, page)
+            times.append(elapsed)
+        rebuilt = ReportStore(store.db_path).sorted_view('DX', args.sort_column)
+        assert view.page(0, len(view)) == rebuilt.page(0, len(rebuilt)), 'updated view differs from a rebuilt one'
+        print(f'{label:>22}: {min(times):8.2f} ms  (median {sorted(times)[len(times) // 2]:.2f} ms)')
+
+
+if __name__ == '__main__':
+    main()
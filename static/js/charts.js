@@ -0,0 +1,97 @@
+/* Draws the page's comparison bar charts in the browser from the chart data embedded by base.html.
+   Each chart image carries its /plot/<key> URL in data-chart-src; when Chart.js isn't available or a
+   chart has no data, that server-rendered PNG is loaded instead. */
+(function () {
+    'use strict';
+
+    var BAR_COLOR = '#5eaaa8';
+    var MIN_WIDTH_PX = 768;
+    var WIDTH_PER_BAR_PX = 48;
+    var HEIGHT_PX = 420;
+
+    function loadFallback(img) {
+        img.src = img.getAttribute('data-chart-src');
+    }
+
+    function drawChart(img, chart) {
+        var scroller = document.createElement('div');
+        scroller.className = 'client-chart';
+        scroller.style.overflowX = 'auto';
+        var frame = document.createElement('div');
+        frame.style.position = 'relative';
+        frame.style.height = HEIGHT_PX + 'px';
+        frame.style.minWidth = Math.max(MIN_WIDTH_PX, chart.x.length * WIDTH_PER_BAR_PX) + 'px';
+        var canvas = document.createElement('canvas');
+        canvas.setAttribute('role', 'img');
+        canvas.setAttribute('aria-label', img.alt || chart.title);
+        frame.appendChild(canvas);
+        scroller.appendChild(frame);
+        img.parentNode.replaceChild(scroller, img);
+
+        new window.Chart(canvas, {
+            type: 'bar',
+            data: {
+                labels: chart.x,
+                datasets: [{ label: chart.y_label, data: chart.y, backgroundColor: BAR_COLOR }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                animation: false,
+                plugins: {
+                    legend: { display: false },
+                    title: { display: true, text: chart.title.split('\n'), font: { size: 14, weight: 'bold' } }
+                },
+                scales: {
+                    x: {
+                        title: { display: true, text: chart.x_label, font: { size: 12 } },
+                        ticks: { maxRotation: 45, minRotation: 45, autoSkip: false },
+                        grid: { display: false }
+                    },
+                    y: {
+                        title: { display: true, text: chart.y_label, font: { size: 12 } },
+                        beginAtZero: true,
+                        border: { dash: [2, 3] }
+                    }
+                }
+            }
+        });
+    }
+
+    function init() {
+        var images = document.querySelectorAll('img[data-chart-src]');
+        if (!images.length) {
+            return;
+        }
+        var chartsByUrl = {};
+        var dataElement = document.getElementById('chart-data');
+        if (dataElement) {
+            JSON.parse(dataElement.textContent).forEach(function (chart) {
+                if (chart.plot_url) {
+                    chartsByUrl[chart.plot_url] = chart;
+                }
+            });
+        }
+        Array.prototype.forEach.call(images, function (img) {
+            var chart = chartsByUrl[img.getAttribute('data-chart-src')];
+            if (!window.Chart || !chart || !chart.x.length) {
+                loadFallback(img);
+                return;
+            }
+            try {
+                drawChart(img, chart);
+            } catch (error) {
+                console.error('Could not draw chart "' + chart.title + '":', error);
+                if (img.parentNode) {
+                    loadFallback(img);
+                }
+            }
+        });
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', init);
+    } else {
+        init();
+    }
+})();